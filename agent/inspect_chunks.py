@@ -5,9 +5,9 @@ Script to inspect and analyze chunks stored in the Chroma database.
 import os
 import time
 from tabulate import tabulate
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
 from utils.hash_utils import load_document_hash
+from utils.embedding_cache import get_embeddings
 
 def inspect_chunks(show_content=True, show_metadata=True, source_filter=None):
     """Inspect chunks stored in the Chroma database and save to file."""
@@ -26,7 +26,7 @@ def inspect_chunks(show_content=True, show_metadata=True, source_filter=None):
         print(f"📝 Document hash: {saved_hash}")
     
     # Initialize vectorstore
-    embedding = OllamaEmbeddings(model="llama2")
+    embedding = get_embeddings()
     vectorstore = Chroma(
         persist_directory=db_dir,
         embedding_function=embedding
@@ -3,28 +3,40 @@ Knowledge Base Agent - A tool for answering questions using document embeddings
 """
 
 # Standard library imports
+import logging
+import math
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 import certifi
 
 # Third-party imports
 from dotenv import load_dotenv
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
-from langchain_community.chat_models import ChatOllama
 from langchain.agents import Tool
-from langchain.chains import RetrievalQA
-from langchain_community.tools import DuckDuckGoSearchRun
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR
 # Local imports
 from agent.utils import (
     compute_and_store_embeddings,
     wait_for_ollama,
     check_and_pull_model
 )
-from agent.utils.compute_embeddings import split_markdown_sections
-from agent.utils.hash_utils import compute_document_hash, load_document_hash, save_document_hash
+from agent.utils.compute_embeddings import load_markdown_documents
+from agent.utils.hash_utils import compute_document_hash, load_document_hash, save_document_hash, load_chunk_manifest, index_matches
+from agent.utils.answer_cache import SemanticAnswerCache
+from agent.utils.routing import QuestionRouter, RouteDecision
+from agent.utils.embedding_cache import get_embeddings
+from agent.utils.ollama_client import EMBEDDING_MODEL
+from agent.utils.context import ContextAssembler, count_tokens
+from agent.utils.rerank import Reranker
+from agent.utils.web_search import WebSearchRateLimited, create_web_search
+from agent.utils.metrics import span, record_answer, record_generation, LLM_FIRST_TOKEN_SECONDS
 
 # ===== Configuration =====
 
+logger = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv(override=True)
 
@@ -53,6 +65,38 @@ DOCUMENT_KEYWORDS = {
 # Flatten keywords for searching
 ALL_DOCUMENT_KEYWORDS = [keyword for keywords in DOCUMENT_KEYWORDS.values() for keyword in keywords]
 
+# Routing: keyword categories first, then the top retrieval score
+question_router = QuestionRouter(
+    DOCUMENT_KEYWORDS,
+    score_threshold=float(os.getenv("ROUTING_SCORE_THRESHOLD", "0.6")),
+    log_path=os.getenv("ROUTING_LOG_PATH")
+)
+
+# Answers reused for questions whose embeddings are at least this similar
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+)
+
+# Retrieved sections are rescored and only the best RERANK_TOP_N go on to the prompt
+reranker = Reranker(
+    top_n=int(os.getenv("RERANK_TOP_N", "6")),
+    lexical_weight=float(os.getenv("RERANK_LEXICAL_WEIGHT", "0.5")),
+    max_entries=int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+)
+
+# Retrieved sections are de-duplicated, diversified and trimmed before prompting
+context_assembler = ContextAssembler(
+    max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "1024")),
+    max_chunks=int(os.getenv("CONTEXT_MAX_CHUNKS", "4")),
+    mmr_lambda=float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7")),
+    duplicate_threshold=float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.98"))
+)
+
+# How many groups of a batch are generated at once by run_custom_agent_batch
+BATCH_CONCURRENCY = int(os.getenv("ASK_BATCH_CONCURRENCY", "2"))
+
 # ===== Initialization =====
 
 def initialize_ollama():
@@ -68,25 +112,23 @@ def initialize_ollama():
 
 def initialize_embeddings():
     """Initialize or load the vector store, only recompute if docs changed."""
-    embedding = OllamaEmbeddings(model="llama2")
+    embedding = get_embeddings()
     db_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db")
     db_dir = os.path.abspath(db_dir)
     docs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs")
     docs_dir = os.path.abspath(docs_dir)
 
     # Compute current hash
-    markdown_files = [f for f in os.listdir(docs_dir) if f.endswith(".md")]
-    all_docs = []
-    for doc_file in markdown_files:
-        file_path = os.path.join(docs_dir, doc_file)
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        chunks = split_markdown_sections(text, doc_file)
-        all_docs.extend(chunks)
+    all_docs = load_markdown_documents(docs_dir)
     current_hash = compute_document_hash(all_docs)
     saved_hash = load_document_hash()
+    # Cached answers and rerank scores are only valid for the documents they came from
+    answer_cache.set_version(current_hash)
+    reranker.clear()
 
-    if current_hash == saved_hash:
+    # Stores built before the chunk manifest existed, or by another embedding
+    # model, are rebuilt
+    if current_hash == saved_hash and index_matches(load_chunk_manifest(), EMBEDDING_MODEL, embedding.dimension()):
         return Chroma(
             persist_directory=db_dir,
             embedding_function=embedding
@@ -115,17 +157,25 @@ If the question doesn't relate to these documents, do not use this tool.
 """
     )
 
-def create_web_search_tool():
-    """Create the web search tool with rate limiting protection."""
-    search = DuckDuckGoSearchRun()
+def create_web_search_tool(search=None):
+    """Create the web search tool.
+
+    Searches go through a WebSearch (see agent.utils.web_search), which is
+    rate limited across worker processes, cached and coalesced. Pass one to
+    share it or to use another backend.
+    """
+    search = search or create_web_search()
+
+    def search_failed(e):
+        if isinstance(e, WebSearchRateLimited):
+            return f"Web search is busy right now. Please try again in {math.ceil(e.retry_after)} seconds."
+        return f"Unable to search the web at this time. Please try again later. Error: {str(e)}"
 
     def safe_search(query):
-        """Wrapper for web search with rate limiting protection."""
-        time.sleep(2)  # Wait to reduce rate limit hits
         try:
-            return search.run(query)
+            return search.search(query)
         except Exception as e:
-            return f"Unable to search the web at this time. Please try again later. Error: {str(e)}"
+            return search_failed(e)
 
     return Tool(
         name="Web Search",
@@ -137,63 +187,344 @@ def create_web_search_tool():
 
 # ===== Question Routing =====
 
-def route_question(question, retriever):
-    """Decide which tool to use based on document relevance and keywords."""
-    q = question.lower()
-    relevant_docs = retriever.invoke(question)
-    has_relevant_docs = len(relevant_docs) > 0
-    has_doc_keywords = any(keyword in q for keyword in ALL_DOCUMENT_KEYWORDS)
-    needs_current_info = any(word in q for word in ["current", "latest", "today", "real-time", "now"])
-
-    if has_relevant_docs:
-        if has_doc_keywords:
-            return "Document Retriever", relevant_docs
-        else:
-            return "Document Retriever", relevant_docs
-    if needs_current_info:
-        return "Web Search", relevant_docs
-    return "Final Answer", relevant_docs
+def route_question(question, retriever, embedding=None, retrieval=None, hits=None):
+    """Decide which tool to use based on document relevance and keywords.
+
+    Returns a RouteDecision with the tool, the matched DOCUMENT_KEYWORDS
+    category and the RetrievalResult, whose documents are then used directly
+    to generate the answer instead of searching again. Pass the question's
+    embedding, retrieval or BM25 hits if they have already been computed.
+    """
+    return question_router.route(question, retriever, embedding, retrieval, hits)
+
+def needs_query_embedding(question, retriever):
+    """(needs an embedding, BM25 hits or None) for a question.
+
+    No embedding is needed when keywords or a decisive BM25 hit settle the
+    question. The hits are passed on to routing, so BM25 runs once.
+    """
+    if not question_router.classify(question).needs_retrieval:
+        return False, None
+    hits = retriever.lexical_search(question)
+    return not retriever.is_lexical_decisive(question, hits), hits
+
+def is_cacheable(response):
+    """Web search answers are time-sensitive, so they are never cached."""
+    return response.get("sources") != ["Web Search"]
 
 def run_custom_agent(question, tools, llm, retriever):
+    """Answer a question, reusing the cached answer of a near-identical one."""
+    started_at = time.perf_counter()
+    # Questions routed on keywords or BM25 alone are never embedded
+    needed, hits = needs_query_embedding(question, retriever)
+    embedding = retriever.embed_query(question) if needed else None
+    cached = lookup_cached_answer(question, embedding)
+    if cached is not None:
+        record_answer("Answer Cache", time.perf_counter() - started_at)
+        return cached
+
+    response = answer_question(question, tools, llm, retriever, embedding, hits)
+    store_answer(question, embedding, response)
+    record_answer(response.get("route", "unknown"), time.perf_counter() - started_at)
+    return response
+
+def lookup_cached_answer(question, embedding=None):
+    """The cached answer for a question's embedding, or for its text if it was not embedded."""
+    with span("answer_cache"):
+        if embedding is None:
+            return answer_cache.lookup_exact(normalize_question(question))
+        return answer_cache.lookup(embedding)
+
+def store_answer(question, embedding, response):
+    """Cache a response where lookup_cached_answer will look for it."""
+    if not is_cacheable(response):
+        return
+    if embedding is None:
+        answer_cache.store_exact(normalize_question(question), response)
+    else:
+        answer_cache.store(embedding, response)
+
+def invoke_llm(llm, prompt):
+    """llm.invoke, timed, with its tokens counted."""
+    started_at = time.perf_counter()
+    with span("llm"):
+        message = llm.invoke(prompt)
+    content = message.content if hasattr(message, 'content') else str(message)
+    record_generation(getattr(llm, "model", "unknown"), getattr(message, "response_metadata", None),
+                      time.perf_counter() - started_at, prompt, content)
+    return message
+
+def web_search(tools, question):
+    with span("web_search"):
+        return tools[1].func(question)
+
+def answer_question(question, tools, llm, retriever, embedding=None, hits=None):
     """Run the appropriate tool based on the question routing."""
-    tool_choice, relevant_docs = route_question(question, retriever)
+    return answer_routed(question, route_question(question, retriever, embedding, hits=hits), tools, llm, retriever)
+
+def answer_routed(question, decision, tools, llm, retriever):
+    """Answer a question with the tool its RouteDecision chose."""
+    tool_choice = decision.tool
 
     if tool_choice == "Document Retriever":
         try:
-            # Get relevant documents
-            # relevant_docs = retriever.invoke(question)
-            # Sort documents by relevance to question
-            relevant_docs.sort(key=lambda x: len(set(question.lower().split()) & 
-                                                set(x.metadata.get('header', '').lower().split())), 
-                             reverse=True)
-            # Get answer from retrieval chain
-            answer = tools[0].func(question)
-            # Format answer with sources
-            return format_answer_with_sources(answer, relevant_docs)
-        except Exception as e:
+            # Answer from the documents found while routing, no second search
+            with span("rerank"):
+                retrieval = reranker.rerank(question, decision.retrieval, retriever.lexical_index)
+            prompt, context = build_document_prompt(question, retrieval, llm)
+            answer = invoke_llm(llm, prompt).content
+            # Cite the chunks the answer was generated from
+            response = format_answer_with_sources(answer, context.documents)
+            response["category"] = decision.category
+            response["prompt_tokens"] = context.prompt_tokens
+            response["route"] = tool_choice
+            return response
+        except Exception:
+            logger.exception("answering from documents failed, asking the LLM directly")
             return {
-                "answer": llm.invoke(question),
-                "sources": []
+                "answer": invoke_llm(llm, question).content,
+                "sources": [],
+                "route": tool_choice
             }
     
     if tool_choice == "Final Answer":
         try:
             return {
-                "answer": llm.invoke(question),
-                "sources": []
+                "answer": invoke_llm(llm, question).content,
+                "sources": [],
+                "route": tool_choice
             }
-        except Exception as e:
+        except Exception:
+            logger.exception("LLM call failed, falling back to web search")
             return {
-                "answer": tools[1].func(question),
-                "sources": ["Web Search"]
+                "answer": web_search(tools, question),
+                "sources": ["Web Search"],
+                "route": "Web Search"
             }
 
     if tool_choice == "Web Search":
         return {
-            "answer": tools[1].func(question),
-            "sources": ["Web Search"]
+            "answer": web_search(tools, question),
+            "sources": ["Web Search"],
+            "route": tool_choice
         }
 
+def build_document_prompt(question, retrieval, llm):
+    """Build the same "stuff" prompt RetrievalQA uses, from already retrieved docs.
+
+    The documents go through the context assembler first. Returns the prompt
+    and the AssembledContext, whose documents are the ones actually used.
+    """
+    with span("context"):
+        context = context_assembler.assemble(retrieval)
+    prompt = PROMPT_SELECTOR.get_prompt(llm).format_prompt(context=context.text, question=question)
+    context.prompt_tokens = count_tokens(prompt.to_string())
+    context_assembler.record(context.prompt_tokens, context.candidate_tokens)
+    logger.info(
+        "prompt tokens %d (context %d of %d retrieved, %d chunks, %d duplicates dropped)",
+        context.prompt_tokens, context.tokens, context.candidate_tokens,
+        len(context.documents), context.duplicates
+    )
+    return prompt, context
+
+def stream_llm_tokens(llm, prompt):
+    """Yield ("token", text) events from the LLM as they are generated."""
+    model = getattr(llm, "model", "unknown")
+    started_at = time.perf_counter()
+    parts = []
+    metadata = None
+    with span("llm"):
+        for chunk in llm.stream(prompt):
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            # Ollama sends its token counts with the last chunk
+            metadata = getattr(chunk, "response_metadata", None) or metadata
+            if text:
+                if not parts:
+                    LLM_FIRST_TOKEN_SECONDS.labels(model).observe(time.perf_counter() - started_at)
+                parts.append(text)
+                yield "token", text
+    record_generation(model, metadata, time.perf_counter() - started_at, prompt, "".join(parts))
+
+def stream_custom_agent(question, tools, llm, retriever):
+    """Streaming variant of run_custom_agent.
+
+    Yields ("sources", list) first, then ("token", str) events as the answer
+    is generated. Closing the generator stops the underlying LLM request.
+    Complete answers are stored in the answer cache like run_custom_agent does.
+    """
+    started_at = time.perf_counter()
+    needed, hits = needs_query_embedding(question, retriever)
+    embedding = retriever.embed_query(question) if needed else None
+    cached = lookup_cached_answer(question, embedding)
+    if cached is not None:
+        yield "sources", cached["sources"]
+        answer = cached["answer"]
+        yield "token", answer.content if hasattr(answer, 'content') else str(answer)
+        record_answer("Answer Cache", time.perf_counter() - started_at)
+        return
+
+    decision = route_question(question, retriever, embedding, hits=hits)
+    sources = []
+    answer_parts = []
+    for kind, payload in _stream_answer(question, decision, tools, llm, retriever):
+        if kind == "sources":
+            sources = payload
+        else:
+            answer_parts.append(payload)
+        yield kind, payload
+
+    store_answer(question, embedding, {"answer": "".join(answer_parts), "sources": sources})
+    record_answer(decision.tool, time.perf_counter() - started_at)
+
+def _stream_answer(question, decision, tools, llm, retriever):
+    """Yield the answer events for a routed question, without caching."""
+    tool_choice = decision.tool
+
+    if tool_choice == "Document Retriever":
+        with span("rerank"):
+            retrieval = reranker.rerank(question, decision.retrieval, retriever.lexical_index)
+        prompt, context = build_document_prompt(question, retrieval, llm)
+        yield "sources", format_answer_with_sources("", context.documents)["sources"]
+        started = False
+        try:
+            for event in stream_llm_tokens(llm, prompt):
+                started = True
+                yield event
+        except Exception:
+            # Same fallback as run_custom_agent, as long as nothing was sent yet
+            if started:
+                raise
+            yield from stream_llm_tokens(llm, question)
+        return
+
+    if tool_choice == "Final Answer":
+        yield "sources", []
+        started = False
+        try:
+            for event in stream_llm_tokens(llm, question):
+                started = True
+                yield event
+        except Exception:
+            if started:
+                raise
+            # A later "sources" event replaces the earlier one
+            yield "sources", ["Web Search"]
+            yield "token", web_search(tools, question)
+        return
+
+    if tool_choice == "Web Search":
+        yield "sources", ["Web Search"]
+        yield "token", web_search(tools, question)
+
+# ===== Batch Answering =====
+
+@dataclass
+class BatchItem:
+    """One question of a batch and what planning found out about it."""
+    index: int
+    question: str
+    embedding: list[float] | None = None
+    hits: list[tuple[str, float]] | None = None  # BM25 hits, once searched
+    decision: RouteDecision | None = None
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+def batch_group_key(item, retriever):
+    """Questions answered from the same reranked sections share a key, and so do repeats."""
+    decision = item.decision
+    if decision.tool == "Document Retriever":
+        retrieval = reranker.rerank(item.question, decision.retrieval, retriever.lexical_index)
+        return ("context", tuple(retrieval.ids))
+    return (decision.tool, normalize_question(item.question))
+
+def plan_batch(questions, retriever):
+    """Embed, search and route a batch of questions together.
+
+    All questions that need an embedding are embedded in one call and
+    searched with one vector store query, reusing their BM25 hits. Returns the responses already
+    known from the answer cache, by index, and the other questions as groups
+    of BatchItem. Repeated questions and questions whose reranked sections
+    are the same land in one group, so they are generated back to back with
+    the same prompt prefix.
+    """
+    items = [BatchItem(index, question) for index, question in enumerate(questions)]
+
+    cached = {}
+    to_embed = []
+    for item in items:
+        needed, item.hits = needs_query_embedding(item.question, retriever)
+        if needed:
+            to_embed.append(item)
+            continue
+        response = lookup_cached_answer(item.question)
+        if response is not None:
+            cached[item.index] = response
+    embeddings = retriever.embed_queries([item.question for item in to_embed]) if to_embed else []
+    to_search = []
+    for item, embedding in zip(to_embed, embeddings):
+        item.embedding = embedding
+        response = lookup_cached_answer(item.question, embedding)
+        if response is not None:
+            cached[item.index] = response
+        else:
+            to_search.append(item)
+
+    retrievals = {}
+    if to_search:
+        found = retriever.search_many(
+            [item.embedding for item in to_search],
+            questions=[item.question for item in to_search],
+            lexical_hits=[item.hits for item in to_search]
+        )
+        retrievals = {item.index: retrieval for item, retrieval in zip(to_search, found)}
+
+    groups = {}
+    for item in items:
+        if item.index in cached:
+            continue
+        item.decision = route_question(item.question, retriever, item.embedding, retrievals.get(item.index), item.hits)
+        groups.setdefault(batch_group_key(item, retriever), []).append(item)
+    return cached, list(groups.values())
+
+def answer_group(group, tools, llm, retriever):
+    """Answer one group from plan_batch; returns (index, response) pairs.
+
+    Each distinct question is generated once, and cacheable answers are
+    stored in the answer cache like run_custom_agent does.
+    """
+    responses = {}
+    answered = []
+    for item in group:
+        key = normalize_question(item.question)
+        if key not in responses:
+            started_at = time.perf_counter()
+            response = answer_routed(item.question, item.decision, tools, llm, retriever)
+            store_answer(item.question, item.embedding, response)
+            record_answer(response.get("route", "unknown"), time.perf_counter() - started_at)
+            responses[key] = response
+        answered.append((item.index, responses[key]))
+    return answered
+
+def iter_custom_agent_batch(questions, tools, llm, retriever, max_workers=BATCH_CONCURRENCY):
+    """Yield (index, response) for each question as soon as its answer is ready.
+
+    Groups are generated on up to max_workers threads.
+    """
+    cached, groups = plan_batch(questions, retriever)
+    yield from cached.items()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch") as pool:
+        futures = [pool.submit(answer_group, group, tools, llm, retriever) for group in groups]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def run_custom_agent_batch(questions, tools, llm, retriever, max_workers=BATCH_CONCURRENCY):
+    """run_custom_agent for a list of questions; responses come back in question order."""
+    responses = [None] * len(questions)
+    for index, response in iter_custom_agent_batch(questions, tools, llm, retriever, max_workers):
+        responses[index] = response
+    return responses
+
 def format_answer_with_sources(answer, docs):
     """Format the answer to show which parts came from which sources (top-k matched chunks)."""
     # If answer is a dictionary, extract the result
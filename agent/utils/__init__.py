@@ -2,17 +2,21 @@
 Utility functions for the knowledge base agent.
 """
 
-from .compute_embeddings import compute_and_store_embeddings
+from .compute_embeddings import compute_and_store_embeddings, sync_embeddings
 from .ollama_utils import get_ollama_path, check_ollama_availability, wait_for_ollama, check_and_pull_model
 from .hash_utils import compute_document_hash, load_document_hash, save_document_hash
+from .retrieval import DocumentRetriever, RetrievalResult
 
 __all__ = [
     'compute_and_store_embeddings',
+    'sync_embeddings',
     'get_ollama_path',
     'check_ollama_availability',
     'wait_for_ollama',
     'check_and_pull_model',
     'compute_document_hash',
     'load_document_hash',
-    'save_document_hash'
+    'save_document_hash',
+    'DocumentRetriever',
+    'RetrievalResult'
 ] 
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Answer cache keyed by question embedding, or by question text for questions never embedded.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+class SemanticAnswerCache:
+    """Reuse answers for questions whose embeddings are nearly identical.
+
+    Questions routed without an embedding are cached by their normalized
+    text instead, in a second table with the same limits. Entries are
+    evicted least-recently-used once max_entries is reached and expire
+    after ttl_seconds. The whole cache is dropped when the document version
+    (the document hash) changes.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # id -> (unit embedding, response, stored_at)
+        self._exact = OrderedDict()  # normalized question -> (response, stored_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        """Record the current document version, clearing the cache if it changed."""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self._exact.clear()
+                self.version = version
+
+    def lookup(self, embedding):
+        """Return the cached response closest to embedding, or None if none is close enough."""
+        query = _unit(embedding)
+        with self._lock:
+            self._expire()
+            if self._entries:
+                ids = list(self._entries)
+                matrix = np.stack([self._entries[i][0] for i in ids])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return dict(self._entries[ids[best]][1])
+            self.misses += 1
+            return None
+
+    def store(self, embedding, response):
+        """Cache a response for the question with this embedding."""
+        with self._lock:
+            self._entries[self._next_id] = (_unit(embedding), dict(response), time.monotonic())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup_exact(self, key: str):
+        """Return the response cached for this normalized question, or None."""
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl_seconds:
+                self._exact.move_to_end(key)
+                self.hits += 1
+                return dict(entry[0])
+            self._exact.pop(key, None)
+            self.misses += 1
+            return None
+
+    def store_exact(self, key: str, response):
+        """Cache a response for this normalized question."""
+        with self._lock:
+            self._exact[key] = (dict(response), time.monotonic())
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_entries": len(self._exact),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _expire(self):
+        # Entries are in least-recently-used order, not insertion order, so check them all
+        cutoff = time.monotonic() - self.ttl_seconds
+        for key in [k for k, (_, _, stored_at) in self._entries.items() if stored_at < cutoff]:
+            del self._entries[key]
+
+def _unit(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,283 @@
+"""
+Streaming, structure-aware markdown chunking.
+
+Files are read line by line and never held in memory whole. ATX headings
+(# to ######) open a section and update its heading path. Headings inside
+fenced code blocks are ignored. A section longer than max_tokens is split
+where a block ends (a blank line, or the edge of a code block or table)
+when possible, otherwise between lines. A code block split in two is closed
+and reopened, and a split table repeats its header rows. The next chunk
+starts with up to overlap_tokens of the text before the cut, as much as
+fits. Every chunk starts with its section's heading line, cut to a quarter
+of max_tokens if longer, and carries the full heading path in its metadata;
+text before the first heading is kept as a chunk of its own.
+"""
+import itertools
+import os
+import re
+from typing import Iterable, Iterator
+
+from langchain.schema import Document
+
+from .context import PIECE_PATTERN, count_tokens, truncate_to_tokens
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+FENCE_PATTERN = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?$")
+# A leading "---" block longer than this is content, not front matter
+MAX_FRONT_MATTER_LINES = 200
+
+class MarkdownChunker:
+    """Splits markdown into Documents of at most max_tokens tokens, one line at a time."""
+
+    def __init__(self, max_tokens: int = 512, overlap_tokens: int = 64):
+        if not 0 <= overlap_tokens < max_tokens // 2:
+            raise ValueError("overlap_tokens must be at least 0 and less than half of max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def split(self, lines: Iterable[str], source: str) -> Iterator[Document]:
+        """Chunk the lines of one markdown file (an open file works)."""
+        lines = iter(lines)
+        first = next(lines, None)
+        if first is None:
+            return
+        if first.strip() == "---":
+            # YAML front matter is for site generators, not content. Without a
+            # closing "---" it was not front matter, so its lines are kept
+            front_matter = [first]
+            for line in itertools.islice(lines, MAX_FRONT_MATTER_LINES):
+                front_matter.append(line)
+                if line.strip() == "---":
+                    front_matter = []
+                    break
+            lines = itertools.chain(front_matter, lines)
+        else:
+            lines = itertools.chain([first], lines)
+        state = _FileState(self, source)
+        for line in lines:
+            yield from state.feed(line)
+        yield from state.flush()
+
+    def split_file(self, path: str, source: str | None = None) -> Iterator[Document]:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from self.split(f, source or os.path.basename(path))
+
+class _FileState:
+    """Chunking state for one file: the heading path and the chunk being filled."""
+
+    def __init__(self, chunker: MarkdownChunker, source: str):
+        self.chunker = chunker
+        self.source = source
+        self.path = []  # [(level, title)] of the enclosing headings
+        self.heading = ""  # heading line of the current section, "" before the first one
+        self.budget = chunker.max_tokens
+        self.part = 0
+        self.fence = None  # (opening line, marker) of the code block we are in
+        self.table_rows = 0
+        self.table_header = None  # header and separator rows of the table we are in
+        self._start_chunk([])
+
+    def feed(self, line: str) -> Iterator[Document]:
+        line = line.rstrip("\r\n") + "\n"
+        if self.fence is None:
+            match = HEADING_PATTERN.match(line)
+            if match:
+                yield from self.flush()
+                level = len(match.group(1))
+                while self.path and self.path[-1][0] >= level:
+                    self.path.pop()
+                self.path.append((level, match.group(2).strip()))
+                # The heading line is repeated in every chunk of the section,
+                # so a long one is cut to leave room for the section's text
+                self.heading = truncate_to_tokens(line.strip(), self.chunker.max_tokens // 4)
+                self.budget = self.chunker.max_tokens - count_tokens(self.heading)
+                self.part = 0
+                self.table_rows = 0
+                self.table_header = None
+                return
+
+        # Taken before _classify updates the block state: what a cut before
+        # this line reopens in the next chunk, and the closing fence it adds
+        # to this one (room for which is reserved). What is reopened takes at
+        # most a quarter of the budget: a long info string is dropped from
+        # the opening fence, and a wide table header is not repeated
+        close = None
+        reopen = []
+        if self.fence is not None:
+            opening, marker = self.fence
+            if count_tokens(opening) > self.budget // 4:
+                opening = marker + "\n"
+            reopen = [(opening, "fence", count_tokens(opening))]
+            close = (marker + "\n", "fence", count_tokens(marker))
+        elif self.table_header is not None and line.lstrip().startswith("|"):
+            reopen = [(row, "table_header", count_tokens(row)) for row in self.table_header]
+            if sum(tokens for _, _, tokens in reopen) > self.budget // 4:
+                reopen = []
+        kind, block_starts = self._classify(line)
+        if block_starts:
+            self.breaks.append(len(self.lines))
+        # The closing fence goes in the room reserved for it, never after a cut
+        closes_fence = close is not None and kind == "fence"
+        reserve = close[2] if close is not None and not closes_fence else 0
+        if kind == "fence" and self.fence is not None:
+            # An opening fence too long for one chunk is split like code in the block
+            marker = self.fence[1]
+            reopen = [(marker + "\n", "fence", count_tokens(marker))]
+            close = reopen[0]
+            reserve = close[2]
+
+        for piece, tokens in self._pieces(line):
+            while not closes_fence and self.tokens + tokens + reserve > self.budget and self._has_content():
+                yield self._cut(reopen, close, tokens + reserve)
+            self._append(piece, kind, tokens)
+
+        if kind == "blank" or (kind == "fence" and self.fence is None):
+            self.breaks.append(len(self.lines))
+
+    def flush(self) -> Iterator[Document]:
+        """Emit what is left of the current section."""
+        if self._has_content():
+            yield self._document(self.lines)
+        self._start_chunk([])
+
+    def _classify(self, line: str) -> tuple[str, bool]:
+        """The kind of line, and whether a new block starts with it; tracks code blocks and tables."""
+        stripped = line.strip()
+        if self.fence is not None:
+            marker = self.fence[1]
+            if stripped.startswith(marker) and set(stripped) == {marker[0]}:
+                self.fence = None
+                return "fence", False
+            return "code", False
+        fence = FENCE_PATTERN.match(line)
+        if fence:
+            self._end_table()
+            self.fence = (line, fence.group(1))
+            return "fence", True
+        if stripped.startswith("|"):
+            self.table_rows += 1
+            if self.table_rows == 1:
+                self.table_header = [line]
+                return "table_header", True
+            if self.table_rows == 2 and TABLE_SEPARATOR_PATTERN.match(stripped):
+                self.table_header.append(line)
+                return "table_header", False
+            if self.table_rows == 2:
+                # Without a separator row there is no header to repeat
+                self.table_header = None
+            return "table", False
+        ended_table = self._end_table()
+        return ("blank" if not stripped else "text"), ended_table
+
+    def _end_table(self) -> bool:
+        ended = self.table_rows > 0
+        self.table_rows = 0
+        self.table_header = None
+        return ended
+
+    def _pieces(self, line: str) -> Iterator[tuple[str, int]]:
+        """The line, or runs of it if it alone would take a large part of a chunk.
+
+        A run takes at most half of the budget: runs end between words when
+        possible, and a word too long for a run is cut every few characters.
+        """
+        tokens = count_tokens(line)
+        limit = max(self.budget // 4, 1)
+        if tokens <= limit:
+            yield line, tokens
+            return
+        # One pass with count_tokens' arithmetic, cutting between words
+        start = used = 0
+        for match in PIECE_PATTERN.finditer(line):
+            piece = match.group(0)
+            cost = (len(piece) + 3) // 4 if piece[0].isalnum() else 1
+            if used and used + cost > limit and (line[match.start() - 1].isspace() or used + cost > 2 * limit):
+                yield line[start:match.start()], used
+                start, used = match.start(), 0
+            while cost > 2 * limit:
+                if used:
+                    yield line[start:match.start()], used
+                    start, used = match.start(), 0
+                # count_tokens charges a word one token per four characters
+                yield line[start:start + 4 * limit], limit
+                start += 4 * limit
+                cost = (match.end() - start + 3) // 4
+            used += cost
+        yield line[start:], used
+
+    def _start_chunk(self, prefix: list):
+        self.lines = []  # (text, kind, tokens)
+        self.tokens = 0
+        self.breaks = []  # indexes into lines where a block ends, i.e. clean places to cut
+        for line in prefix:
+            self._append(*line)
+        self.content_start = len(self.lines)  # lines before this repeat the previous chunk
+
+    def _append(self, text: str, kind: str, tokens: int):
+        self.lines.append((text, kind, tokens))
+        self.tokens += tokens
+
+    def _has_content(self) -> bool:
+        return any(kind != "blank" for _, kind, _ in self.lines[self.content_start:])
+
+    def _cut(self, reopen: list, close: tuple | None, needed: int) -> Document:
+        """Emit the current chunk up to its last clean cut (or all of it) and start the next one.
+
+        A cut inside a block starts the next chunk with reopen, and adds
+        close (the closing fence of a code block) to this one. The overlap
+        leaves room for needed tokens, the piece that did not fit.
+        """
+        clean = [index for index in self.breaks if index > self.content_start]
+        cut = clean[-1] if clean else len(self.lines)
+        emitted, remainder = self.lines[:cut], self.lines[cut:]
+        prefix = [] if clean else reopen
+        room = self.budget - needed - sum(line[2] for line in prefix + remainder)
+        overlap = self._overlap(emitted, min(self.chunker.overlap_tokens, room))
+        if not clean and close is not None:
+            if emitted and not emitted[-1][0].endswith("\n"):
+                # The cut split a line, the fence still needs one of its own
+                close = ("\n" + close[0],) + close[1:]
+            emitted = emitted + [close]
+        document = self._document(emitted)
+        breaks = [index - cut for index in self.breaks if index > cut]
+        self._start_chunk(prefix + overlap)
+        offset = len(self.lines)
+        for line in remainder:
+            self._append(*line)
+        self.breaks = [offset + index for index in breaks]
+        return document
+
+    def _overlap(self, lines: list, max_tokens: int) -> list:
+        """The last lines of a block that fit in max_tokens."""
+        lines = list(itertools.dropwhile(lambda line: line[1] == "blank", reversed(lines)))
+        if not lines or lines[0][1] not in ("text", "code", "table"):
+            return []
+        kind = lines[0][1]
+        overlap, tokens = [], 0
+        for line in lines:
+            if line[1] != kind or tokens + line[2] > max_tokens:
+                break
+            overlap.append(line)
+            tokens += line[2]
+        return overlap[::-1]
+
+    def _document(self, lines: list) -> Document:
+        body = "".join(text for text, _, _ in lines)
+        self.part += 1
+        return Document(
+            page_content=f"{self.heading}\n{body}".strip(),
+            metadata={
+                "source": self.source,
+                "header": self.path[-1][1] if self.path else "",
+                "heading_path": " > ".join(title for _, title in self.path),
+                "part": self.part,
+            }
+        )
+
+def create_chunker() -> MarkdownChunker:
+    """A chunker sized by CHUNK_MAX_TOKENS and CHUNK_OVERLAP_TOKENS."""
+    return MarkdownChunker(
+        max_tokens=int(os.getenv("CHUNK_MAX_TOKENS", "512")),
+        overlap_tokens=int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+    )
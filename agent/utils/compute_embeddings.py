@@ -2,48 +2,93 @@
 Utility functions for computing and storing document embeddings.
 """
 import os
-import re
+from typing import Iterator
 from langchain.schema import Document
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
-from .hash_utils import compute_document_hash, load_document_hash, save_document_hash
+from .chunking import MarkdownChunker, create_chunker
+from .ingestion import embed_and_store
+from .embedding_cache import get_embeddings
+from .ollama_client import EMBEDDING_MODEL
+from .hash_utils import (
+    compute_document_hash,
+    save_document_hash,
+    compute_chunk_hash,
+    compute_chunk_id,
+    load_chunk_manifest,
+    save_chunk_manifest,
+    clear_chunk_manifest,
+    index_matches
+)
 
 def split_markdown_sections(text: str, filename: str) -> list[Document]:
-    """Split markdown by uniform ## headers into Document chunks."""
-    pattern = r"(##\s+.+?)(?=\n##\s+|\Z)"
-    matches = re.findall(pattern, text, re.DOTALL)
-
-    documents = []
-    for match in matches:
-        header_line = match.splitlines()[0].strip()
-        section_title = header_line.lstrip('#').strip()
-        content = match.strip()
-        doc = Document(
-            page_content=content,
-            metadata={
-                "source": filename,
-                "header": section_title
+    """Split markdown text into heading-aware chunks (see MarkdownChunker)."""
+    return list(create_chunker().split(text.splitlines(keepends=True), filename))
+
+def iter_markdown_documents(docs_dir: str, chunker: MarkdownChunker | None = None) -> Iterator[Document]:
+    """Stream the chunks of every markdown file in docs_dir, reading each file line by line."""
+    chunker = chunker or create_chunker()
+    for doc_file in os.listdir(docs_dir):
+        if doc_file.endswith(".md"):
+            yield from chunker.split_file(os.path.join(docs_dir, doc_file), doc_file)
+
+def load_markdown_documents(docs_dir: str, chunker: MarkdownChunker | None = None) -> list[Document]:
+    """Split every markdown file in docs_dir into chunk Documents."""
+    return list(iter_markdown_documents(docs_dir, chunker))
+
+def sync_embeddings(all_docs: list[Document], vectorstore, index: dict | None = None) -> dict:
+    """Bring the vector store in line with all_docs, embedding only what changed.
+
+    Chunk IDs are content-addressed, so an edited section gets a new ID: it
+    is embedded and added, and its old ID is deleted. Unchanged sections are
+    left alone. index ({"embedding_model", "dim"}) is saved with the
+    manifest. Returns the number of chunks added, removed and kept.
+    """
+    current = {}
+    for doc in all_docs:
+        current.setdefault(compute_chunk_id(doc), doc)
+
+    manifest = load_chunk_manifest()
+    if manifest is None:
+        # No manifest yet: compare against whatever the collection holds
+        # (e.g. random IDs from an older full rebuild), so it all gets replaced.
+        existing = set(vectorstore.get(include=[])["ids"])
+    else:
+        existing = set(manifest["chunks"])
+
+    removed = [chunk_id for chunk_id in existing if chunk_id not in current]
+    added = [chunk_id for chunk_id in current if chunk_id not in existing]
+
+    if removed:
+        vectorstore.delete(ids=removed)
+    if added:
+        embed_and_store([current[chunk_id] for chunk_id in added], added, vectorstore, vectorstore.embeddings)
+
+    save_chunk_manifest({
+        **(index or {}),
+        "chunks": {
+            chunk_id: {
+                "source": doc.metadata.get("source", ""),
+                "header": doc.metadata.get("header", ""),
+                "heading_path": doc.metadata.get("heading_path", ""),
+                "hash": compute_chunk_hash(doc)
             }
-        )
-        documents.append(doc)
-    return documents
+            for chunk_id, doc in current.items()
+        }
+    })
+    return {"added": len(added), "removed": len(removed), "kept": len(current) - len(added)}
 
-def compute_and_store_embeddings(embedding_model="llama2"):
-    """Compute embeddings from normalized markdown files and store them."""
+def compute_and_store_embeddings(embedding_model=EMBEDDING_MODEL):
+    """Compute embeddings for new or changed markdown sections and store them.
+
+    An index built by another embedding model, or with another vector
+    dimension, is dropped and rebuilt.
+    """
     docs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../docs")
     docs_dir = os.path.abspath(docs_dir)
     db_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../db")
     db_dir = os.path.abspath(db_dir)
 
-    markdown_files = [f for f in os.listdir(docs_dir) if f.endswith(".md")]
-    all_docs = []
-
-    for doc_file in markdown_files:
-        file_path = os.path.join(docs_dir, doc_file)
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        chunks = split_markdown_sections(text, doc_file)
-        all_docs.extend(chunks)
+    all_docs = load_markdown_documents(docs_dir)
 
     if not all_docs:
         raise ValueError("No documents loaded.")
@@ -51,14 +96,24 @@ def compute_and_store_embeddings(embedding_model="llama2"):
     os.makedirs(db_dir, exist_ok=True)
 
     current_hash = compute_document_hash(all_docs)
-    saved_hash = load_document_hash()
 
-    embedding = OllamaEmbeddings(model=embedding_model)
-    vectorstore = Chroma.from_documents(
-        all_docs,
-        embedding,
-        persist_directory=db_dir
+    embedding = get_embeddings(embedding_model)
+    index = {"embedding_model": embedding_model, "dim": embedding.dimension()}
+    vectorstore = Chroma(
+        persist_directory=db_dir,
+        embedding_function=embedding
     )
+    manifest = load_chunk_manifest()
+    if manifest is not None and not index_matches(manifest, **index):
+        print(f"🔄 Index was built by {manifest.get('embedding_model', 'an older version')} "
+              f"({manifest.get('dim', '?')} dims), rebuilding it for {embedding_model} ({index['dim']} dims)")
+        vectorstore.delete_collection()
+        clear_chunk_manifest()
+        vectorstore = Chroma(
+            persist_directory=db_dir,
+            embedding_function=embedding
+        )
+    sync_embeddings(all_docs, vectorstore, index)
 
     save_document_hash(current_hash)
 
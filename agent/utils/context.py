@@ -0,0 +1,174 @@
+"""
+Context assembly: turns retrieved sections into a compact prompt context.
+
+Duplicate and near-duplicate chunks are dropped, the rest are picked by
+maximal marginal relevance (MMR) so the context is relevant without
+repeating itself, and the result is trimmed to a token budget.
+"""
+import hashlib
+import re
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain.schema import Document
+
+from .lexical_index import tokenize
+
+# Words, numbers and single punctuation marks
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text: str) -> int:
+    """Fast local estimate of the llama2 token count.
+
+    Punctuation is one token, and SentencePiece splits long words into
+    pieces of about four characters.
+    """
+    return sum((len(piece) + 3) // 4 if piece[0].isalnum() else 1 for piece in PIECE_PATTERN.findall(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text at the last whole piece that fits in max_tokens."""
+    used = 0
+    for match in PIECE_PATTERN.finditer(text):
+        piece = match.group(0)
+        used += (len(piece) + 3) // 4 if piece[0].isalnum() else 1
+        if used > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+@dataclass
+class AssembledContext:
+    """The documents that made it into the prompt and what they cost."""
+    documents: list[Document] = field(default_factory=list)
+    text: str = ""
+    tokens: int = 0
+    candidate_tokens: int = 0  # tokens of all retrieved chunks, before assembly
+    duplicates: int = 0
+    prompt_tokens: int = 0  # the whole prompt, set once it is built
+
+class ContextAssembler:
+    """De-duplicates, diversifies (MMR) and budgets retrieved chunks.
+
+    Relevance is the retrieval rank. Similarity between chunks uses the
+    document vectors of the RetrievalResult; results found by BM25 alone
+    carry no vectors, in which case term overlap stands in.
+    """
+
+    def __init__(self, max_tokens: int = 1024, max_chunks: int = 4, mmr_lambda: float = 0.7,
+                 duplicate_threshold: float = 0.98):
+        self.max_tokens = max_tokens
+        self.max_chunks = max_chunks
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.candidate_tokens = 0
+        self._lock = threading.Lock()
+
+    def assemble(self, retrieval) -> AssembledContext:
+        documents = list(retrieval.documents)
+        if not documents:
+            return AssembledContext()
+        candidate_tokens = sum(count_tokens(doc.page_content) for doc in documents)
+
+        relevance = self._relevance(retrieval)
+        similarity = self._similarity(retrieval)
+        keep = self._deduplicate(documents, similarity)
+        order = self._mmr(keep, relevance, similarity)
+
+        selected = []
+        used = 0
+        for index in order:
+            if len(selected) >= self.max_chunks:
+                break
+            text = documents[index].page_content
+            tokens = count_tokens(text)
+            if used + tokens > self.max_tokens:
+                if selected:
+                    continue  # a shorter chunk further down may still fit
+                # Always keep the best chunk, cut to the budget
+                text = truncate_to_tokens(text, self.max_tokens)
+                tokens = count_tokens(text)
+            selected.append(Document(page_content=text, metadata=documents[index].metadata))
+            used += tokens
+
+        return AssembledContext(
+            documents=selected,
+            text="\n\n".join(doc.page_content for doc in selected),
+            tokens=used,
+            candidate_tokens=candidate_tokens,
+            duplicates=len(documents) - len(keep)
+        )
+
+    def record(self, prompt_tokens: int, candidate_tokens: int):
+        """Count one prompt sent to the LLM."""
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.candidate_tokens += candidate_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "max_tokens": self.max_tokens,
+                "avg_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0.0,
+                "avg_candidate_tokens": self.candidate_tokens / self.requests if self.requests else 0.0,
+            }
+
+    def _relevance(self, retrieval) -> np.ndarray:
+        # The retriever's order already fuses vector and BM25 evidence, so
+        # relevance follows rank, scaled to (0, 1]
+        count = len(retrieval.documents)
+        return 1.0 - np.arange(count, dtype=np.float32) / count
+
+    def _similarity(self, retrieval) -> np.ndarray:
+        """Pairwise similarity between the retrieved chunks."""
+        vectors = retrieval.vectors
+        if len(vectors) == len(retrieval.documents) and all(v is not None for v in vectors):
+            matrix = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms[:, None]
+            return matrix @ matrix.T
+        # Jaccard overlap of the chunks' terms
+        terms = [set(tokenize(doc.page_content)) for doc in retrieval.documents]
+        count = len(terms)
+        similarity = np.eye(count, dtype=np.float32)
+        for i in range(count):
+            for j in range(i + 1, count):
+                union = len(terms[i] | terms[j])
+                similarity[i, j] = similarity[j, i] = len(terms[i] & terms[j]) / union if union else 0.0
+        return similarity
+
+    def _deduplicate(self, documents: list[Document], similarity: np.ndarray) -> list[int]:
+        """Indexes of the chunks to keep, best ranked copy first."""
+        keep = []
+        seen = set()
+        for index, doc in enumerate(documents):
+            text = doc.page_content.strip()
+            digest = hashlib.md5(text.encode("utf-8")).hexdigest()
+            if digest in seen:
+                continue
+            if any(
+                similarity[index, kept] >= self.duplicate_threshold
+                or text in documents[kept].page_content
+                for kept in keep
+            ):
+                continue
+            seen.add(digest)
+            keep.append(index)
+        return keep
+
+    def _mmr(self, candidates: list[int], relevance: np.ndarray, similarity: np.ndarray) -> list[int]:
+        """Order candidates by maximal marginal relevance."""
+        remaining = list(candidates)
+        order = []
+        while remaining:
+            if order:
+                redundancy = similarity[np.ix_(remaining, order)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            order.append(remaining.pop(int(np.argmax(scores))))
+        return order
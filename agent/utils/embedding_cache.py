@@ -0,0 +1,327 @@
+"""
+Persistent embedding cache shared by ingestion, inspection and queries.
+
+Vectors live in a memory-mapped file, one row per text, stored as float32,
+float16 or int8 (with one float32 scale per row). A small SQLite index maps
+(text hash -> row) and records when each row was last used, so the least
+recently used rows are reused once the cache is full. There is one cache
+directory per embedding model.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .ollama_client import EMBEDDING_MODEL, PooledOllamaEmbeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../db/embedding_cache"))
+
+# Storage type -> vectors file suffix
+DTYPES = {"float32": "f32", "float16": "f16", "int8": "i8"}
+
+class EmbeddingCache:
+    """Disk-backed map from text hash to embedding vector with LRU eviction.
+
+    dtype float16 halves the file and int8 quarters it. int8 rows are scaled
+    by their largest component, which keeps cosine similarities within about
+    0.001 of the float32 ones. Changing dtype, or receiving vectors of another
+    dimension, empties the cache.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 20000, initial_capacity: int = 1024, dtype: str = "float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported embedding cache dtype {dtype!r}, expected one of {', '.join(DTYPES)}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_entries = max_entries
+        self.initial_capacity = initial_capacity
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._scales = None
+        self._vectors_path = os.path.join(directory, f"vectors.{DTYPES[dtype]}")
+        self._scales_path = os.path.join(directory, "scales.f32")
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER UNIQUE, last_used REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        meta = self._meta()
+        self.dim = meta.get("dim")
+        self.capacity = meta.get("capacity", 0)
+        # Caches written before dtype was recorded are float32
+        if meta.get("dtype", "float32") != dtype:
+            logger.info("embedding cache %s switches from %s to %s, starting empty", directory, meta.get("dtype", "float32"), dtype)
+            self._reset()
+        elif self.dim:
+            self._open_vectors()
+
+    @staticmethod
+    def key(text: str, kind: str = "document") -> str:
+        # Documents and queries are embedded with different instructions
+        return hashlib.sha256(f"{kind}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict:
+        """Return {key: vector} for the keys that are cached."""
+        with self._lock:
+            if keys and not self.dim:
+                # Another process may have stored the first vectors since
+                self._load_vectors()
+            if not keys or not self.dim:
+                self.misses += len(keys)
+                return {}
+            rows = self._lookup_rows(keys)
+            found = {key: self._read(row) for key, row in rows.items()}
+            if found:
+                self._touch(list(found))
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return found
+
+    def put_many(self, items: dict):
+        """Store {key: vector}, evicting the least recently used rows when full."""
+        if not items:
+            return
+        if len(items) > self.max_entries:
+            items = dict(list(items.items())[-self.max_entries:])
+        with self._lock:
+            dim = len(next(iter(items.values())))
+            if self.dim and dim != self.dim:
+                # The model behind this cache changed; its old vectors are useless
+                logger.warning("embedding cache %s gets %d-dim vectors instead of %d, starting empty", self.directory, dim, self.dim)
+                self._reset()
+            if not self.dim:
+                self.dim = dim
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (self.dim,))
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                assigned = self._lookup_rows(list(items))
+                # Mark rows being overwritten as fresh so they are not evicted below
+                self._touch(list(assigned))
+                new_keys = [key for key in items if key not in assigned]
+                assigned.update(zip(new_keys, self._allocate_rows(len(new_keys))))
+                now = time.time()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO entries (key, row, last_used) VALUES (?, ?, ?)",
+                    [(key, row, now) for key, row in assigned.items()]
+                )
+                for key, row in assigned.items():
+                    self._write(row, items[key])
+                self._vectors.flush()
+                if self._scales is not None:
+                    self._scales.flush()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "bytes": self.capacity * self._row_bytes() if self.dim else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _meta(self) -> dict:
+        return dict(self._db.execute("SELECT name, value FROM meta").fetchall())
+
+    def _lookup_rows(self, keys: list[str]) -> dict:
+        rows = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.update(self._db.execute(f"SELECT key, row FROM entries WHERE key IN ({placeholders})", chunk).fetchall())
+        return rows
+
+    def _touch(self, keys: list[str]):
+        now = time.time()
+        self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in keys])
+
+    def _allocate_rows(self, count: int) -> list[int]:
+        # Rows are always dense (0..used-1) because evicted rows are reused
+        used = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        fresh = min(count, self.max_entries - used)
+        rows = list(range(used, used + fresh))
+        if count > fresh:
+            evicted = self._db.execute(
+                "SELECT key, row FROM entries ORDER BY last_used LIMIT ?", (count - fresh,)
+            ).fetchall()
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            rows.extend(row for _, row in evicted)
+        self._ensure_capacity(used + fresh)
+        return rows
+
+    def _ensure_capacity(self, rows: int):
+        if self._vectors is not None and len(self._vectors) >= rows:
+            return
+        # Another process may have grown the file already; never shrink it
+        capacity = max(self.capacity, self._meta().get("capacity", 0), self.initial_capacity)
+        while capacity < rows:
+            capacity *= 2
+        self.capacity = min(capacity, self.max_entries)
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('capacity', ?)", (self.capacity,))
+        self._open_vectors()
+
+    def _load_vectors(self):
+        """Map the vectors at the dim and capacity last written by any process."""
+        meta = self._meta()
+        if meta.get("dim"):
+            self.dim = meta["dim"]
+            self.capacity = max(self.capacity, meta.get("capacity", 0))
+            self._open_vectors()
+
+    def _open_vectors(self):
+        self._vectors = self._open_memmap(self._vectors_path, self.dtype, (self.capacity, self.dim))
+        if self.dtype == "int8":
+            self._scales = self._open_memmap(self._scales_path, "float32", (self.capacity,))
+
+    @staticmethod
+    def _open_memmap(path: str, dtype: str, shape: tuple) -> np.memmap:
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _read(self, row: int) -> list[float]:
+        if row >= len(self._vectors):
+            # The row was added after another process grew the file
+            self._load_vectors()
+        vector = self._vectors[row].astype(np.float32)
+        if self._scales is not None:
+            vector *= self._scales[row]
+        return vector.tolist()
+
+    def _write(self, row: int, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if self._scales is not None:
+            scale = float(np.abs(vector).max()) / 127 or 1.0
+            self._vectors[row] = np.round(vector / scale).astype(np.int8)
+            self._scales[row] = scale
+        else:
+            self._vectors[row] = vector
+
+    def _row_bytes(self) -> int:
+        return self.dim * np.dtype(self.dtype).itemsize + (4 if self.dtype == "int8" else 0)
+
+    def _reset(self):
+        """Drop every entry and vector file, keeping the configured dtype."""
+        self._vectors = self._scales = None
+        self._db.execute("DELETE FROM entries")
+        self._db.execute("DELETE FROM meta")
+        self._db.execute("INSERT INTO meta VALUES ('dtype', ?)", (self.dtype,))
+        for suffix in DTYPES.values():
+            path = os.path.join(self.directory, f"vectors.{suffix}")
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self._scales_path):
+            os.remove(self._scales_path)
+        self.dim = None
+        self.capacity = 0
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts the cache has not seen to the model."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self.cache.key(text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        if missing:
+            computed = dict(zip((self.cache.key(text) for text in missing), self.embeddings.embed_documents(missing)))
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self.cache.key(text, kind="query")
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """embed_query for many texts; the ones the cache has not seen go to the model in one call."""
+        keys = [self.cache.key(text, kind="query") for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        if missing:
+            computed = dict(zip((self.cache.key(text, kind="query") for text in missing), self._embed_queries(missing)))
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def _embed_queries(self, texts: list[str]) -> list[list[float]]:
+        # OllamaEmbeddings prefixes queries with query_instruction, so a batch
+        # must do the same to get the vectors embed_query would
+        instruction = getattr(self.embeddings, "query_instruction", None)
+        if instruction is not None and hasattr(self.embeddings, "_embed"):
+            return self.embeddings._embed([f"{instruction}{text}" for text in texts])
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def dimension(self) -> int:
+        """Length of the vectors this model produces."""
+        return len(self.embed_query("dimension"))
+
+# Dedicated embedding models are trained with their own document and query
+# prefixes. Other models get OllamaEmbeddings' defaults ("passage: " / "query: ")
+EMBEDDING_INSTRUCTIONS = {
+    "nomic-embed-text": ("search_document: ", "search_query: "),
+    "mxbai-embed-large": ("", "Represent this sentence for searching relevant passages: "),
+    "snowflake-arctic-embed": ("", "Represent this sentence for searching relevant passages: "),
+    "all-minilm": ("", ""),
+    "bge-m3": ("", ""),
+}
+
+def create_ollama_embeddings(model: str) -> PooledOllamaEmbeddings:
+    """Pooled Ollama embeddings with the instruction prefixes the model expects."""
+    instructions = EMBEDDING_INSTRUCTIONS.get(model.split(":")[0])
+    if instructions is None:
+        return PooledOllamaEmbeddings(model=model)
+    embed_instruction, query_instruction = instructions
+    return PooledOllamaEmbeddings(model=model, embed_instruction=embed_instruction, query_instruction=query_instruction)
+
+_embeddings = {}
+_embeddings_lock = threading.Lock()
+
+def get_embeddings(model: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """Shared, cached Ollama embeddings for a model (one instance per process)."""
+    with _embeddings_lock:
+        if model not in _embeddings:
+            directory = os.path.join(
+                os.getenv("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR),
+                re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+            )
+            cache = EmbeddingCache(
+                directory,
+                max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "20000")),
+                dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float32")
+            )
+            _embeddings[model] = CachedEmbeddings(create_ollama_embeddings(model), cache)
+        return _embeddings[model]
+
+def embedding_cache_stats() -> dict:
+    """Cache statistics for every model used in this process."""
+    with _embeddings_lock:
+        return {model: embeddings.cache.stats() for model, embeddings in _embeddings.items()}
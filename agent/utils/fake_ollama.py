@@ -0,0 +1,206 @@
+"""
+A local fake Ollama server for tests and load experiments.
+
+Speaks enough of the Ollama HTTP API for this app: /api/tags, /api/version,
+/api/pull, /api/embeddings, /api/embed, and streaming or non-streaming
+/api/chat and /api/generate. Embeddings are deterministic hashed
+bag-of-words vectors, and answers are canned text streamed word by word
+with an optional delay per token. Run several on different ports to try
+multi-endpoint setups:
+
+    python -m agent.utils.fake_ollama --port 11500 --token-delay 0.02
+    OLLAMA_BASE_URL=http://localhost:11500 uvicorn app.main:app
+
+Or from Python:
+
+    with FakeOllama() as server:
+        os.environ["OLLAMA_BASE_URL"] = server.url
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def fake_embedding(text: str, dim: int = 64) -> list[float]:
+    """Hashed bag of words: texts sharing words get similar vectors."""
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % dim] += 1.0
+    return vector
+
+class FakeOllama:
+    """A fake Ollama server on a background thread; port 0 picks a free port."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, models=("llama2:latest",), dim: int = 64,
+                 token_delay: float = 0.0, reply: str | None = None):
+        self.models = set(models)
+        self.dim = dim
+        self.token_delay = token_delay
+        self.reply = reply
+        self.fail = False  # answer every request with 500 while set
+        self.requests = {}  # path -> count
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def answer_for(self, prompt: str) -> str:
+        if self.reply is not None:
+            return self.reply
+        return f"This is a fake answer to: {prompt.strip()[-60:]}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def _handle(self, method):
+                with server._lock:
+                    server.requests[self.path] = server.requests.get(self.path, 0) + 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+                    if server.fail:
+                        return self._json(500, {"error": "fake failure"})
+                    route = {
+                        ("GET", "/api/tags"): self._tags,
+                        ("GET", "/api/version"): lambda body: self._json(200, {"version": "0.0.0-fake"}),
+                        ("POST", "/api/pull"): self._pull,
+                        ("POST", "/api/embeddings"): self._embeddings,
+                        ("POST", "/api/embed"): self._embed,
+                        ("POST", "/api/chat"): self._chat,
+                        ("POST", "/api/generate"): self._generate,
+                    }.get((method, self.path))
+                    if route is None:
+                        return self._json(404, {"error": f"{self.path} not found"})
+                    route(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _json(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _tags(self, body):
+                self._json(200, {"models": [{"name": name, "model": name} for name in sorted(server.models)]})
+
+            def _pull(self, body):
+                name = body.get("name") or body.get("model")
+                server.models.add(name if ":" in name else f"{name}:latest")
+                self._json(200, {"status": "success"})
+
+            def _embeddings(self, body):
+                self._json(200, {"embedding": fake_embedding(body.get("prompt", ""), server.dim)})
+
+            def _embed(self, body):
+                inputs = body.get("input", "")
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._json(200, {"model": body.get("model"), "embeddings": [fake_embedding(text, server.dim) for text in inputs]})
+
+            def _chat(self, body):
+                messages = body.get("messages") or [{}]
+                answer = server.answer_for(messages[-1].get("content", ""))
+                prompt = " ".join(message.get("content", "") for message in messages)
+                self._respond(body, prompt, answer, lambda text: {"message": {"role": "assistant", "content": text}})
+
+            def _generate(self, body):
+                answer = server.answer_for(body.get("prompt", ""))
+                self._respond(body, body.get("prompt", ""), answer, lambda text: {"response": text})
+
+            def _respond(self, body, prompt, answer, content):
+                started_at = time.perf_counter()
+                words = re.findall(r"\s*\S+", answer)
+                base = {"model": body.get("model"), "created_at": datetime.now(timezone.utc).isoformat()}
+
+                def final():
+                    elapsed = int((time.perf_counter() - started_at) * 1e9)
+                    return {
+                        **base, **content(""), "done": True, "done_reason": "stop",
+                        "prompt_eval_count": len(prompt.split()), "eval_count": len(words),
+                        "eval_duration": max(elapsed, 1), "total_duration": max(elapsed, 1),
+                    }
+
+                if body.get("stream", True) is False:
+                    if server.token_delay:
+                        time.sleep(server.token_delay * len(words))
+                    return self._json(200, {**final(), **content(answer)})
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for word in words:
+                    if server.token_delay:
+                        time.sleep(server.token_delay)
+                    self._chunk(json.dumps({**base, **content(word), "done": False}) + "\n")
+                self._chunk(json.dumps(final()) + "\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dim", type=int, default=64, help="Embedding dimensions")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds per streamed token")
+    parser.add_argument("--reply", help="Fixed answer text")
+    args = parser.parse_args()
+    server = FakeOllama(args.host, args.port, dim=args.dim, token_delay=args.token_delay, reply=args.reply)
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ Utility functions for document hash computation and management.
 """
 
 import os
+import json
 import hashlib
 
 def compute_document_hash(documents):
@@ -28,4 +29,49 @@ def save_document_hash(hash_value):
     db_dir = os.path.abspath(db_dir)
     os.makedirs(db_dir, exist_ok=True)
     with open(os.path.join(db_dir, "document_hash.txt"), "w") as f:
-        f.write(hash_value) 
\ No newline at end of file
+        f.write(hash_value)
+
+def compute_chunk_hash(document):
+    """Hash of a single chunk's content."""
+    return hashlib.md5(document.page_content.encode()).hexdigest()
+
+def compute_chunk_id(document):
+    """Stable, content-addressed ID for a chunk: source + header + content hash."""
+    source = document.metadata.get("source", "")
+    header = document.metadata.get("header", "")
+    return f"{source}:{header}:{compute_chunk_hash(document)}"
+
+def load_chunk_manifest():
+    """Load the saved {chunk_id: {source, header}} manifest, or None if there is none."""
+    db_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../db")
+    db_dir = os.path.abspath(db_dir)
+    try:
+        with open(os.path.join(db_dir, "chunk_manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_chunk_manifest(manifest):
+    """Save the chunk manifest."""
+    db_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../db")
+    db_dir = os.path.abspath(db_dir)
+    os.makedirs(db_dir, exist_ok=True)
+    with open(os.path.join(db_dir, "chunk_manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def clear_chunk_manifest():
+    """Forget the chunk manifest, e.g. after the collection was dropped."""
+    db_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../db")
+    db_dir = os.path.abspath(db_dir)
+    try:
+        os.remove(os.path.join(db_dir, "chunk_manifest.json"))
+    except FileNotFoundError:
+        pass
+
+def index_matches(manifest, embedding_model, dim):
+    """Whether the manifest's index was built by this embedding model with vectors of this dimension."""
+    return (
+        manifest is not None
+        and manifest.get("embedding_model") == embedding_model
+        and manifest.get("dim") == dim
+    )
@@ -0,0 +1,68 @@
+"""
+Batched, parallel embedding pipeline for writing chunks into the vector store.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def print_progress(done, total, elapsed):
+    """Default progress reporter."""
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"📦 Embedded {done}/{total} chunks ({rate:.1f} chunks/s)")
+
+def embed_with_retry(embedding, texts, max_retries=3, backoff=1.0):
+    """Embed one batch, retrying with exponential backoff on failure."""
+    for attempt in range(max_retries + 1):
+        try:
+            return embedding.embed_documents(texts)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def embed_and_store(docs, ids, vectorstore, embedding,
+                    batch_size=None, concurrency=None, max_retries=None,
+                    progress=print_progress):
+    """Embed docs in batches against the embedding endpoint and upsert them as they finish.
+
+    At most `concurrency` batches are embedded at once and at most twice that
+    many are held in memory, so memory stays bounded however many docs there
+    are. Returns the number of chunks written.
+    """
+    batch_size = batch_size or int(os.getenv("EMBED_BATCH_SIZE", "32"))
+    concurrency = concurrency or int(os.getenv("EMBED_CONCURRENCY", "4"))
+    max_retries = max_retries if max_retries is not None else int(os.getenv("EMBED_MAX_RETRIES", "3"))
+
+    total = len(docs)
+    done = 0
+    started_at = time.perf_counter()
+
+    def write(future):
+        nonlocal done
+        batch_ids, batch_docs, vectors = future.result()
+        vectorstore._collection.upsert(
+            ids=batch_ids,
+            embeddings=vectors,
+            documents=[doc.page_content for doc in batch_docs],
+            metadatas=[doc.metadata for doc in batch_docs]
+        )
+        done += len(batch_ids)
+        if progress:
+            progress(done, total, time.perf_counter() - started_at)
+
+    def embed_batch(batch_ids, batch_docs):
+        vectors = embed_with_retry(embedding, [doc.page_content for doc in batch_docs], max_retries)
+        return batch_ids, batch_docs, vectors
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as pool:
+        pending = set()
+        for start in range(0, total, batch_size):
+            if len(pending) >= concurrency * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write(future)
+            pending.add(pool.submit(embed_batch, ids[start:start + batch_size], docs[start:start + batch_size]))
+        for future in pending:
+            write(future)
+
+    return done
@@ -0,0 +1,95 @@
+"""
+In-process BM25 index over the markdown sections, for exact-term retrieval.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+# Keeps model numbers and dotted/hyphenated terms whole, e.g. "rock960", "usb-c", "3.0"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+
+STOP_WORDS = frozenset("""
+a about an and any are as at be by can do does for from get have how i in is it me my of on or our
+the their there this to was we what when where which who why will with you your
+""".split())
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens without stop words."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of (id, text) pairs."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self._postings = {}  # term -> [(doc index, term frequency)]
+        self._idf = {}
+        self._lengths = []
+        self._avg_length = 0.0
+        self._positions = {}  # id -> doc index
+
+    def build(self, ids: list[str], texts: list[str]):
+        """(Re)build the index from scratch."""
+        postings = defaultdict(list)
+        lengths = []
+        for index, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                postings[term].append((index, frequency))
+        count = len(texts)
+        self.ids = list(ids)
+        self._postings = dict(postings)
+        self._idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+        self._lengths = lengths
+        self._avg_length = sum(lengths) / count if count else 0.0
+        self._positions = {chunk_id: index for index, chunk_id in enumerate(self.ids)}
+        return self
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs):
+        """Build an index over exactly what the Chroma collection holds."""
+        contents = vectorstore.get(include=["documents"])
+        return cls(**kwargs).build(contents["ids"], contents["documents"])
+
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """Top k (id, score) pairs, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self._postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / self._avg_length)
+                scores[index] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[index], score) for index, score in best]
+
+    def idf(self, term: str) -> float:
+        """Inverse document frequency of a term; unseen terms get the maximum."""
+        return self._idf.get(term, math.log(1 + (len(self.ids) + 0.5) / 0.5))
+
+    def coverage(self, query: str, chunk_id: str) -> float:
+        """Fraction of the query's terms that occur in the given document."""
+        terms = set(tokenize(query))
+        index = self._positions.get(chunk_id)
+        if not terms or index is None:
+            return 0.0
+        matched = sum(
+            1 for term in terms
+            if any(doc_index == index for doc_index, _ in self._postings.get(term, ()))
+        )
+        return matched / len(terms)
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """Merge several ranked id lists; ids ranked high in any list come first."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
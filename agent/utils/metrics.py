@@ -0,0 +1,102 @@
+"""
+Per-stage latency spans and LLM throughput, exported as Prometheus metrics.
+
+Wrap a stage in `with span("embed"):`. Every span is observed in the
+tako_stage_seconds histogram. Spans that run while a request collects them
+(see collect_spans) are also kept for that request, which is how the
+Server-Timing header is built.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram
+
+from .context import count_tokens
+
+# Embedding and search take milliseconds, generation takes tens of seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "tako_stage_seconds", "Time spent in each stage of answering a question", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter("tako_stage_errors_total", "Stages that raised an exception", ["stage"])
+ANSWER_SECONDS = Histogram(
+    "tako_answer_seconds", "Time to produce a complete answer, by the tool that answered", ["route"],
+    buckets=LATENCY_BUCKETS
+)
+ROUTES = Counter("tako_routes_total", "Routing decisions", ["route", "reason"])
+LLM_TOKENS = Counter("tako_llm_tokens_total", "Tokens sent to and generated by the LLM", ["model", "direction"])
+LLM_TOKENS_PER_SECOND = Histogram(
+    "tako_llm_tokens_per_second", "Generation speed of LLM calls", ["model"],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "tako_llm_first_token_seconds", "Time until a streamed LLM call yields its first token", ["model"],
+    buckets=LATENCY_BUCKETS
+)
+COALESCED_REQUESTS = Counter(
+    "tako_coalesced_requests_total", "Requests answered by an identical request already in flight", ["kind"]
+)
+
+# (stage, seconds) spans of the current request, when it collects them
+_request_spans: ContextVar[list | None] = ContextVar("request_spans", default=None)
+
+@contextmanager
+def collect_spans():
+    """Collect the spans of everything run in this context, including executor threads started from it."""
+    spans = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+def observe(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage: str):
+    """Time a stage; exceptions are counted and re-raised."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        # A closed generator is not a failure
+        if not isinstance(e, GeneratorExit):
+            STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started_at)
+
+def record_route(decision):
+    ROUTES.labels(decision.tool, decision.reason).inc()
+
+def record_answer(route: str, seconds: float):
+    ANSWER_SECONDS.labels(route).observe(seconds)
+
+def record_generation(model: str, metadata: dict, seconds: float, prompt="", completion=""):
+    """Count the tokens of one LLM call and its tokens per second.
+
+    Ollama reports prompt_eval_count, eval_count and eval_duration (ns) in
+    the response metadata; without them the tokens are estimated from the
+    text and the speed from the wall-clock time.
+    """
+    metadata = metadata or {}
+    prompt_tokens = metadata.get("prompt_eval_count") or count_tokens(str(prompt))
+    completion_tokens = metadata.get("eval_count") or count_tokens(completion)
+    generation_seconds = (metadata.get("eval_duration") or 0) / 1e9 or seconds
+    LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+    if completion_tokens and generation_seconds > 0:
+        LLM_TOKENS_PER_SECOND.labels(model).observe(completion_tokens / generation_seconds)
+
+def server_timing(spans: list[tuple[str, float]]) -> str:
+    """A Server-Timing header value, one entry per stage with the durations summed."""
+    totals = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
@@ -0,0 +1,313 @@
+"""
+Ollama client layer: pooled keep-alive sessions over one or more endpoints.
+
+Each pool holds a list of Ollama endpoints, each with its own requests
+Session, so connections are reused instead of opened per call. Requests go
+to the healthy endpoint with the fewest outstanding requests. A background
+thread checks endpoint health, and a failed request marks its endpoint
+unhealthy right away. Embedding and generation traffic use separate pools,
+configured by OLLAMA_EMBED_URLS and OLLAMA_GENERATE_URLS (comma-separated,
+both defaulting to OLLAMA_BASE_URL).
+
+PooledChatOllama and PooledOllamaEmbeddings are drop-in replacements for the
+LangChain classes that send their requests through a pool. The chat and
+embedding models are set separately by CHAT_MODEL and EMBEDDING_MODEL.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from langchain_community.chat_models import ChatOllama
+from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+
+# Answers come from CHAT_MODEL and vectors from EMBEDDING_MODEL, a dedicated
+# embedding model that is far smaller and faster than a chat model
+CHAT_MODEL = os.getenv("CHAT_MODEL", "llama2")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+
+class OllamaUnavailable(Exception):
+    """Raised when no endpoint of a pool could serve a request."""
+
+class OllamaEndpoint:
+    """One Ollama server with its own keep-alive session."""
+
+    def __init__(self, url: str, max_connections: int = 16):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.healthy = True  # until a check or a request says otherwise
+        self.models = set()
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.checked_at = None
+
+    def check(self, timeout: float = 2) -> bool:
+        """Probe /api/tags, recording health and the models the server has."""
+        try:
+            response = self.session.get(f"{self.url}/api/tags", timeout=timeout)
+            response.raise_for_status()
+            self.models = {model["name"] for model in response.json().get("models", [])}
+            self.healthy = True
+            self.last_error = None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.healthy = False
+            self.last_error = str(e)
+        self.checked_at = time.time()
+        return self.healthy
+
+    def has_model(self, model: str) -> bool:
+        # Ollama lists "llama2" as "llama2:latest"
+        return model in self.models or f"{model}:latest" in self.models
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+class OllamaPool:
+    """Least-outstanding-requests balancing over Ollama endpoints, with health checks."""
+
+    def __init__(self, name: str, urls: list[str], max_connections: int = 16, health_interval: float = 10):
+        self.name = name
+        self.endpoints = [OllamaEndpoint(url, max_connections) for url in urls]
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._next = 0  # rotates ties between equally loaded endpoints
+        self._checker = None
+        self._stop = threading.Event()
+
+    @contextmanager
+    def endpoint(self) -> Iterator[OllamaEndpoint]:
+        """Hold the healthy endpoint with the fewest outstanding requests for one request."""
+        with self._lock:
+            # If every endpoint looks down the health data may be stale; try them anyway
+            self._next = (self._next + 1) % len(self.endpoints)
+            rotated = self.endpoints[self._next:] + self.endpoints[:self._next]
+            candidates = [endpoint for endpoint in rotated if endpoint.healthy] or rotated
+            chosen = min(candidates, key=lambda endpoint: endpoint.outstanding)
+            chosen.outstanding += 1
+            chosen.requests += 1
+        try:
+            yield chosen
+        except requests.exceptions.ConnectionError as e:
+            self.mark_failed(chosen, e)
+            raise
+        finally:
+            with self._lock:
+                chosen.outstanding -= 1
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send one request, moving on to the next endpoint if the connection fails."""
+        error = None
+        for _ in range(len(self.endpoints)):
+            try:
+                with self.endpoint() as endpoint:
+                    return endpoint.session.request(method, f"{endpoint.url}{path}", **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                error = e
+        raise OllamaUnavailable(f"No Ollama endpoint of the {self.name} pool is reachable: {error}")
+
+    def mark_failed(self, endpoint: OllamaEndpoint, error: Exception):
+        with self._lock:
+            endpoint.healthy = False
+            endpoint.failures += 1
+            endpoint.last_error = str(error)
+        logger.warning("Ollama endpoint %s (%s pool) failed: %s", endpoint.url, self.name, error)
+
+    def check_health(self) -> bool:
+        """Check every endpoint now; True if at least one is healthy."""
+        return any([endpoint.check() for endpoint in self.endpoints])
+
+    def wait_until_healthy(self, timeout: float = 60) -> bool:
+        """Check with a short, growing interval until an endpoint is up or timeout passes."""
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        while True:
+            if self.check_health():
+                return True
+            if time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+    def start_health_checks(self):
+        """Re-check all endpoints every health_interval seconds on a daemon thread."""
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._check_loop, name=f"ollama-health-{self.name}", daemon=True)
+                self._checker.start()
+
+    def stop_health_checks(self):
+        self._stop.set()
+
+    def _check_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"endpoints": [endpoint.stats() for endpoint in self.endpoints]}
+
+def parse_urls(value: str | None) -> list[str]:
+    return [url.strip() for url in (value or "").split(",") if url.strip()]
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(kind: str) -> OllamaPool:
+    """The shared "embed" or "generate" pool, configured from the environment."""
+    with _pools_lock:
+        if kind not in _pools:
+            urls = parse_urls(os.getenv(f"OLLAMA_{kind.upper()}_URLS")) or parse_urls(os.getenv("OLLAMA_BASE_URL", DEFAULT_BASE_URL))
+            _pools[kind] = OllamaPool(
+                kind,
+                urls,
+                max_connections=int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16")),
+                health_interval=float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+            )
+        return _pools[kind]
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        return {kind: pool.stats() for kind, pool in _pools.items()}
+
+class PooledChatOllama(ChatOllama):
+    """ChatOllama whose requests go through the "generate" pool.
+
+    The endpoint is held for the whole response, so a streaming answer
+    counts as outstanding until its last token.
+    """
+
+    def _create_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[str]:
+        # Same request as ChatOllama builds, sent over a pooled session
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+        path = api_url[len(self.base_url):] if api_url.startswith(self.base_url) else api_url
+        pool = get_pool("generate")
+        for attempt in range(len(pool.endpoints)):
+            with pool.endpoint() as endpoint:
+                try:
+                    response = endpoint.session.post(
+                        url=f"{endpoint.url}{path}",
+                        headers={
+                            "Content-Type": "application/json",
+                            **(self.headers if isinstance(self.headers, dict) else {}),
+                        },
+                        auth=self.auth,
+                        json=request_payload,
+                        stream=True,
+                        timeout=self.timeout,
+                    )
+                except requests.exceptions.ConnectionError as e:
+                    # Nothing has been yielded yet, so another endpoint can take over
+                    pool.mark_failed(endpoint, e)
+                    if attempt == len(pool.endpoints) - 1:
+                        raise OllamaUnavailable(f"No Ollama endpoint of the {pool.name} pool is reachable: {e}")
+                    continue
+                response.encoding = "utf-8"
+                if response.status_code != 200:
+                    if response.status_code == 404:
+                        raise OllamaEndpointNotFoundError(
+                            "Ollama call failed with status code 404. "
+                            f"Maybe your model is not found and you should pull the model with `ollama pull {self.model}`."
+                        )
+                    raise ValueError(f"Ollama call failed with status code {response.status_code}. Details: {response.text}")
+                with response:
+                    yield from response.iter_lines(decode_unicode=True)
+                return
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings whose requests go through the "embed" pool.
+
+    A batch is spread over the pool's endpoints instead of embedded one text
+    at a time.
+    """
+
+    def _embed(self, input: List[str]) -> List[List[float]]:
+        workers = min(len(input), max(1, len(get_pool("embed").endpoints)) * int(os.getenv("OLLAMA_EMBED_PARALLELISM", "2")))
+        if workers <= 1:
+            return [self._process_emb_response(prompt) for prompt in input]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ollama-embed") as pool:
+            return list(pool.map(self._process_emb_response, input))
+
+    def _process_emb_response(self, input: str) -> List[float]:
+        try:
+            response = get_pool("embed").request(
+                "POST",
+                "/api/embeddings",
+                headers={"Content-Type": "application/json", **(self.headers or {})},
+                json={"model": self.model, "prompt": input, **self._default_params},
+            )
+        except (requests.exceptions.RequestException, OllamaUnavailable) as e:
+            raise ValueError(f"Error raised by inference endpoint: {e}")
+        if response.status_code != 200:
+            raise ValueError(f"Error raised by inference API HTTP code: {response.status_code}, {response.text}")
+        try:
+            return response.json()["embedding"]
+        except (ValueError, KeyError) as e:
+            raise ValueError(f"Error raised by inference API: {e}.\nResponse: {response.text}")
+
+def pull_model(pool: OllamaPool, model: str, timeout: float = 3600):
+    """Pull model on every endpoint of pool that does not have it yet."""
+    for endpoint in pool.endpoints:
+        if not endpoint.models:
+            endpoint.check()
+        if endpoint.healthy and not endpoint.has_model(model):
+            logger.info("pulling %s on %s", model, endpoint.url)
+            response = endpoint.session.post(f"{endpoint.url}/api/pull", json={"name": model, "stream": False}, timeout=timeout)
+            response.raise_for_status()
+            status = response.json().get("status")
+            if status != "success":
+                raise RuntimeError(f"Pulling {model} on {endpoint.url} failed: {json.dumps(response.json())}")
+            endpoint.models.add(model)
@@ -1,9 +1,9 @@
 import os
 import sys
-import requests
-import subprocess
 import time
 
+from .ollama_client import CHAT_MODEL, EMBEDDING_MODEL, get_pool, pull_model
+
 def get_ollama_path():
     """Get the path to the Ollama executable based on the operating system."""
     if sys.platform == "win32":
@@ -35,30 +35,23 @@ If you've already installed Ollama in a custom location, please add it to your s
     return "ollama"  # For non-Windows systems
 
 def check_ollama_availability():
-    """Check if Ollama is running and available."""
-    try:
-        response = requests.get("http://localhost:11434/api/tags")
-        return response.status_code == 200
-    except requests.exceptions.ConnectionError:
-        return False
+    """Check if Ollama is running and available for both embedding and generation."""
+    available = get_pool("embed").check_health() and get_pool("generate").check_health()
+    if available:
+        # Keep health fresh from now on, so failed endpoints come back into rotation
+        get_pool("embed").start_health_checks()
+        get_pool("generate").start_health_checks()
+    return available
 
 def wait_for_ollama(timeout=60):
     """Wait for Ollama to become available."""
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if check_ollama_availability():
-            return True
-        time.sleep(5)
-    return False
+    deadline = time.monotonic() + timeout
+    for kind in ("embed", "generate"):
+        if not get_pool(kind).wait_until_healthy(max(0.0, deadline - time.monotonic())):
+            return False
+    return check_ollama_availability()
 
-def check_and_pull_model(model_name="llama2"):
-    """Check if model exists and pull it if it doesn't."""
-    try:
-        response = requests.get(f"http://localhost:11434/api/tags")
-        models = response.json().get("models", [])
-        model_exists = any(model["name"] == model_name for model in models)
-        if not model_exists:
-            ollama_path = get_ollama_path()
-            subprocess.run([ollama_path, "pull", model_name], check=True)
-    except Exception as e:
-        raise 
\ No newline at end of file
+def check_and_pull_model(chat_model=CHAT_MODEL, embedding_model=EMBEDDING_MODEL):
+    """Check that every endpoint has its pool's model and pull it where it doesn't."""
+    pull_model(get_pool("embed"), embedding_model)
+    pull_model(get_pool("generate"), chat_model)
@@ -0,0 +1,122 @@
+"""
+Rerank stage between retrieval and generation.
+
+Scores every retrieved chunk with a cheap CPU scorer: IDF-weighted query
+term overlap (body and header) blended with the embedding cosine. Scores
+are memoized per (question, chunk id), so repeat questions cost nothing.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import replace
+
+import numpy as np
+
+from .lexical_index import tokenize
+from .retrieval import cosine_scores
+
+class Reranker:
+    """Reorders a RetrievalResult and keeps its top_n chunks."""
+
+    def __init__(self, top_n: int = 6, lexical_weight: float = 0.5, header_weight: float = 0.3,
+                 max_entries: int = 10000):
+        self.top_n = top_n
+        self.lexical_weight = lexical_weight
+        self.header_weight = header_weight
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()  # ((question, has embedding), chunk id) -> score
+        self._lock = threading.Lock()
+
+    def rerank(self, question: str, retrieval, lexical_index=None):
+        """Return a copy of retrieval, best first by rerank score, cut to top_n.
+
+        lexical_index supplies IDF weights for the query terms; without it
+        every term counts the same.
+        """
+        if not retrieval.documents:
+            return retrieval
+        # Lexical-only results are scored without the cosine term, so they are memoized apart
+        key = (" ".join(question.lower().split()), retrieval.embedding is not None)
+        ids = retrieval.ids if len(retrieval.ids) == len(retrieval.documents) else [None] * len(retrieval.documents)
+
+        scores = np.empty(len(ids), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for index, chunk_id in enumerate(ids):
+                cached = self._scores.get((key, chunk_id)) if chunk_id is not None else None
+                if cached is None:
+                    missing.append(index)
+                else:
+                    self._scores.move_to_end((key, chunk_id))
+                    scores[index] = cached
+            self.hits += len(ids) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            scores[missing] = self._score(question, retrieval, missing, lexical_index)
+            with self._lock:
+                for index in missing:
+                    if ids[index] is not None:
+                        self._scores[(key, ids[index])] = float(scores[index])
+                while len(self._scores) > self.max_entries:
+                    self._scores.popitem(last=False)
+
+        order = np.argsort(-scores, kind="stable")[:self.top_n].tolist()
+        pick = lambda values: [values[i] for i in order] if len(values) == len(ids) else values
+        return replace(
+            retrieval,
+            documents=pick(retrieval.documents),
+            scores=pick(retrieval.scores),
+            ids=pick(retrieval.ids),
+            vectors=pick(retrieval.vectors),
+            rerank_scores=[float(scores[i]) for i in order]
+        )
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._scores),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _score(self, question: str, retrieval, indexes: list[int], lexical_index) -> np.ndarray:
+        """Scores for the chunks at indexes, computed over the candidate matrix at once."""
+        terms = list(dict.fromkeys(tokenize(question)))
+        docs = [retrieval.documents[i] for i in indexes]
+
+        lexical = np.zeros(len(indexes), dtype=np.float32)
+        if terms:
+            weights = np.asarray(
+                [lexical_index.idf(term) if lexical_index is not None else 1.0 for term in terms],
+                dtype=np.float32
+            )
+            weights /= weights.sum() or 1.0
+            # Candidates x query terms: 1 where the chunk contains the term
+            body = term_matrix((doc.page_content for doc in docs), terms)
+            header = term_matrix((doc.metadata.get("header", "") for doc in docs), terms)
+            lexical = (1 - self.header_weight) * (body @ weights) + self.header_weight * (header @ weights)
+
+        if len(retrieval.scores) == len(retrieval.documents):
+            cosine = np.asarray([retrieval.scores[i] for i in indexes], dtype=np.float32)
+        elif retrieval.embedding is not None and len(retrieval.vectors) == len(retrieval.documents):
+            cosine = cosine_scores(retrieval.embedding, [retrieval.vectors[i] for i in indexes])
+        else:
+            # Found by BM25 alone: there is no query embedding to compare with
+            return lexical
+        return self.lexical_weight * lexical + (1 - self.lexical_weight) * cosine
+
+def term_matrix(texts, terms: list[str]) -> np.ndarray:
+    """One row per text, one column per term, 1.0 where the text contains the term."""
+    rows = []
+    for text in texts:
+        tokens = set(tokenize(text))
+        rows.append([term in tokens for term in terms])
+    return np.asarray(rows, dtype=np.float32).reshape(len(rows), len(terms))
@@ -0,0 +1,178 @@
+"""
+Single-pass hybrid (BM25 + vector) retrieval that keeps the query embedding and similarity scores.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain.schema import Document
+
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+from .metrics import span
+
+@dataclass
+class RetrievalResult:
+    """Documents found for one query, best match first."""
+    documents: list[Document] = field(default_factory=list)
+    scores: list[float] = field(default_factory=list)  # cosine similarity to the query
+    ids: list[str] = field(default_factory=list)
+    embedding: list[float] | None = None  # the query embedding
+    vectors: list[list[float]] = field(default_factory=list)  # document embeddings
+    lexical_match: bool = False  # the top BM25 hit contains every query term
+    lexical_decisive: bool = False  # found by BM25 alone, without embedding the query
+    rerank_scores: list[float] = field(default_factory=list)  # set by the rerank stage
+
+class DocumentRetriever:
+    """Hybrid search over the Chroma collection.
+
+    Vector results are fused with an in-process BM25 index by reciprocal-rank
+    fusion, which helps exact terms like "rock960" or "HDMI". When the BM25
+    top hit clearly beats the runner-up, the query is not embedded at all.
+    Unlike a LangChain retriever it returns the query embedding and the
+    scores along with the documents, so later steps can reuse them instead
+    of embedding and searching again.
+    """
+
+    def __init__(self, vectorstore, k: int = 10, lexical_min_score: float = 5.0, lexical_ratio: float = 1.5):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.lexical_min_score = lexical_min_score
+        self.lexical_ratio = lexical_ratio
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the BM25 index from the collection, e.g. after re-indexing."""
+        self.lexical_index = BM25Index.from_vectorstore(self.vectorstore)
+
+    def embed_query(self, question: str) -> list[float]:
+        """Embed a question with the same model used for the documents."""
+        with span("embed"):
+            return self.vectorstore.embeddings.embed_query(question)
+
+    def embed_queries(self, questions: list[str]) -> list[list[float]]:
+        """Embed many questions in one batched call when the embeddings support it."""
+        embeddings = self.vectorstore.embeddings
+        with span("embed"):
+            if hasattr(embeddings, "embed_queries"):
+                return embeddings.embed_queries(questions)
+            return [embeddings.embed_query(question) for question in questions]
+
+    def lexical_search(self, question: str, k: int | None = None) -> list[tuple[str, float]]:
+        with span("bm25"):
+            return self.lexical_index.search(question, k or self.k)
+
+    def is_lexical_match(self, question: str, hits: list[tuple[str, float]]) -> bool:
+        """True when the top BM25 hit scores well and contains every query term."""
+        if not hits or hits[0][1] < self.lexical_min_score:
+            return False
+        return self.lexical_index.coverage(question, hits[0][0]) == 1.0
+
+    def is_lexical_decisive(self, question: str, hits: list[tuple[str, float]]) -> bool:
+        """True when the top BM25 hit is a match and well ahead of the next one."""
+        if not self.is_lexical_match(question, hits):
+            return False
+        return len(hits) == 1 or hits[0][1] >= self.lexical_ratio * hits[1][1]
+
+    def search(self, embedding, k: int | None = None, question: str | None = None,
+               hits: list[tuple[str, float]] | None = None) -> RetrievalResult:
+        """Find the k closest documents to an already computed query embedding.
+
+        If the question text is given, vector and BM25 rankings are fused.
+        Pass the question's lexical_search hits if they are already known.
+        """
+        return self.search_many(
+            [embedding], k, None if question is None else [question], None if hits is None else [hits]
+        )[0]
+
+    def search_many(self, embeddings: list, k: int | None = None, questions: list[str] | None = None,
+                    lexical_hits: list | None = None) -> list[RetrievalResult]:
+        """search for several query embeddings with one vector store query.
+
+        Sections only BM25 found are fetched in one call for all queries.
+        lexical_hits holds each question's BM25 hits, or None where they
+        still have to be searched.
+        """
+        k = k or self.k
+        with span("vector_search"):
+            results = self.vectorstore._collection.query(
+                query_embeddings=list(embeddings),
+                n_results=k,
+                include=["documents", "metadatas", "embeddings"]
+            )
+        found = {}
+        rankings = []
+        for ids, texts, metadatas, vectors in zip(
+            results["ids"], results["documents"], results["metadatas"], results["embeddings"]
+        ):
+            for chunk_id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+                found[chunk_id] = (Document(page_content=text, metadata=metadata or {}), vector)
+            rankings.append(list(ids))
+
+        lexical_matches = [False] * len(rankings)
+        if questions is not None:
+            for index, question in enumerate(questions):
+                hits = lexical_hits[index] if lexical_hits is not None else None
+                if hits is None:
+                    hits = self.lexical_search(question, k)
+                lexical_matches[index] = self.is_lexical_match(question, hits)
+                rankings[index] = reciprocal_rank_fusion([rankings[index], [chunk_id for chunk_id, _ in hits]])[:k]
+            missing = list(dict.fromkeys(chunk_id for ranked in rankings for chunk_id in ranked if chunk_id not in found))
+            found.update(self._fetch(missing, include_vectors=True))
+
+        retrievals = []
+        for embedding, ranked, lexical_match in zip(embeddings, rankings, lexical_matches):
+            if not ranked:
+                retrievals.append(RetrievalResult(embedding=embedding))
+                continue
+            vectors = [found[chunk_id][1] for chunk_id in ranked]
+            retrievals.append(RetrievalResult(
+                documents=[found[chunk_id][0] for chunk_id in ranked],
+                scores=cosine_scores(embedding, vectors).tolist(),
+                ids=ranked,
+                embedding=embedding,
+                vectors=vectors,
+                lexical_match=lexical_match
+            ))
+        return retrievals
+
+    def retrieve(self, question: str, k: int | None = None, hits: list[tuple[str, float]] | None = None) -> RetrievalResult:
+        """Answer from BM25 alone when it is decisive, else embed once and run the hybrid search.
+
+        Pass the question's lexical_search hits if they are already known.
+        """
+        if hits is None:
+            hits = self.lexical_search(question, k)
+        if self.is_lexical_decisive(question, hits):
+            ids = [chunk_id for chunk_id, _ in hits]
+            found = self._fetch(ids, include_vectors=False)
+            return RetrievalResult(
+                documents=[found[chunk_id][0] for chunk_id in ids if chunk_id in found],
+                ids=[chunk_id for chunk_id in ids if chunk_id in found],
+                lexical_match=True,
+                lexical_decisive=True
+            )
+        return self.search(self.embed_query(question), k, question=question, hits=hits)
+
+    def invoke(self, question: str) -> list[Document]:
+        """LangChain-style retriever call returning only the documents."""
+        return self.retrieve(question).documents
+
+    def _fetch(self, ids: list[str], include_vectors: bool) -> dict:
+        """{id: (Document, vector)} for ids, straight from the collection."""
+        if not ids:
+            return {}
+        include = ["documents", "metadatas"] + (["embeddings"] if include_vectors else [])
+        with span("fetch"):
+            results = self.vectorstore._collection.get(ids=ids, include=include)
+        vectors = results["embeddings"] if include_vectors else [None] * len(results["ids"])
+        return {
+            chunk_id: (Document(page_content=text, metadata=metadata or {}), vector)
+            for chunk_id, text, metadata, vector in zip(results["ids"], results["documents"], results["metadatas"], vectors)
+        }
+
+def cosine_scores(query, vectors) -> np.ndarray:
+    """Cosine similarity between one query vector and each row of vectors."""
+    query = np.asarray(query, dtype=np.float32)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1.0
+    return matrix @ query / norms
@@ -0,0 +1,147 @@
+"""
+Question routing: precompiled keyword matching plus retrieval score thresholds.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+from .metrics import record_route
+from .retrieval import RetrievalResult
+
+logger = logging.getLogger(__name__)
+
+# Words that suggest the answer depends on up-to-date information
+CURRENT_INFO_WORDS = ["current", "latest", "today", "real-time", "now"]
+
+# Messages that clearly need no documents
+SMALL_TALK = [
+    "hi", "hello", "hey", "thanks", "thank you", "good morning", "good afternoon",
+    "good evening", "bye", "goodbye", "how are you", "who are you"
+]
+
+def compile_phrases(phrases) -> re.Pattern:
+    """One alternation regex over all phrases, longest first, matching whole words (plurals allowed)."""
+    alternatives = sorted({phrase.lower() for phrase in phrases}, key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(re.escape(phrase) for phrase in alternatives) + r")(?:s|es)?\b", re.IGNORECASE)
+
+@dataclass
+class KeywordMatch:
+    """What the keyword stage found in a question."""
+    category: str | None = None
+    keywords: list[str] = field(default_factory=list)
+    needs_current_info: bool = False
+    small_talk: bool = False
+
+    @property
+    def needs_retrieval(self) -> bool:
+        """False when the question can be routed without a vector search."""
+        return self.category is not None or not (self.needs_current_info or self.small_talk)
+
+@dataclass
+class RouteDecision:
+    """Which tool answers a question, and why."""
+    tool: str
+    category: str | None
+    reason: str
+    retrieval: RetrievalResult = field(default_factory=RetrievalResult)
+    top_score: float | None = None
+    timings: dict = field(default_factory=dict)
+
+class QuestionRouter:
+    """Routes questions to "Document Retriever", "Web Search" or "Final Answer".
+
+    All category keywords are compiled into a single regex. Questions with
+    no document keywords that are small talk or ask for current information
+    skip the vector search entirely. Otherwise the top retrieval score must
+    reach score_threshold, unless a document keyword matched.
+    """
+
+    def __init__(self, categories: dict, score_threshold: float = 0.6, log_path: str | None = None):
+        self.score_threshold = score_threshold
+        self.log_path = log_path
+        self._categories = {keyword.lower(): category for category, keywords in categories.items() for keyword in keywords}
+        self._keyword_pattern = compile_phrases(self._categories)
+        self._current_pattern = compile_phrases(CURRENT_INFO_WORDS)
+        self._small_talk_pattern = re.compile(
+            r"^\W*(?:" + "|".join(re.escape(phrase) for phrase in sorted(SMALL_TALK, key=len, reverse=True)) + r")\W*$",
+            re.IGNORECASE
+        )
+        self._log_lock = threading.Lock()
+
+    def classify(self, question: str) -> KeywordMatch:
+        """Keyword stage: matched category, current-info words and small talk."""
+        keywords = [m.group(1).lower() for m in self._keyword_pattern.finditer(question)]
+        category = None
+        if keywords:
+            counts = {}
+            for keyword in keywords:
+                counts[self._categories[keyword]] = counts.get(self._categories[keyword], 0) + 1
+            category = max(counts, key=counts.get)
+        return KeywordMatch(
+            category=category,
+            keywords=keywords,
+            needs_current_info=self._current_pattern.search(question) is not None,
+            small_talk=self._small_talk_pattern.match(question) is not None
+        )
+
+    def route(self, question: str, retriever, embedding=None, retrieval: RetrievalResult | None = None,
+              hits: list[tuple[str, float]] | None = None) -> RouteDecision:
+        """Decide the tool, searching the vector store only when it can matter.
+
+        Pass retrieval if the question has already been searched, e.g. as
+        part of a batch, or hits if only its BM25 search has been run.
+        """
+        started_at = time.perf_counter()
+        match = self.classify(question)
+        timings = {"keywords": (time.perf_counter() - started_at) * 1000}
+
+        if not match.needs_retrieval:
+            if match.needs_current_info:
+                decision = RouteDecision("Web Search", None, "current information, no document keywords", timings=timings)
+            else:
+                decision = RouteDecision("Final Answer", None, "small talk", timings=timings)
+            self._log(question, decision)
+            return decision
+
+        step_at = time.perf_counter()
+        if retrieval is None and embedding is None:
+            # Embeds the question unless BM25 alone is decisive
+            retrieval = retriever.retrieve(question, hits=hits)
+            timings["retrieve"] = (time.perf_counter() - step_at) * 1000
+        elif retrieval is None:
+            retrieval = retriever.search(embedding, question=question, hits=hits)
+            timings["search"] = (time.perf_counter() - step_at) * 1000
+        top_score = max(retrieval.scores) if retrieval.scores else None
+
+        if retrieval.documents and match.category:
+            decision = RouteDecision("Document Retriever", match.category, "document keywords", retrieval, top_score, timings)
+        elif retrieval.documents and retrieval.lexical_match:
+            decision = RouteDecision("Document Retriever", None, "lexical match", retrieval, top_score, timings)
+        elif retrieval.documents and top_score >= self.score_threshold:
+            decision = RouteDecision("Document Retriever", None, "retrieval score", retrieval, top_score, timings)
+        elif match.needs_current_info:
+            decision = RouteDecision("Web Search", None, "current information", retrieval, top_score, timings)
+        else:
+            decision = RouteDecision("Final Answer", None, "no relevant documents", retrieval, top_score, timings)
+        self._log(question, decision)
+        return decision
+
+    def _log(self, question: str, decision: RouteDecision):
+        record_route(decision)
+        record = {
+            "time": time.time(),
+            "question": question,
+            "tool": decision.tool,
+            "category": decision.category,
+            "reason": decision.reason,
+            "top_score": decision.top_score,
+            "timings_ms": {name: round(value, 3) for name, value in decision.timings.items()},
+        }
+        logger.info("route decision %s", json.dumps(record))
+        if self.log_path:
+            with self._log_lock:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
@@ -0,0 +1,217 @@
+"""
+Web search with a shared rate limit, a result cache and in-flight coalescing.
+
+Searches are rate limited by a token bucket kept in a SQLite file, so every
+worker process on the host draws from the same budget. Results are cached
+by normalized query for a while, and identical searches already in flight
+wait for that search instead of starting their own. The backend is
+pluggable: DuckDuckGo by default, or a local stub for tests and offline use.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+DEFAULT_STATE_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../db/web_search.sqlite3"))
+
+class WebSearchRateLimited(Exception):
+    """Raised when no search token would be free within the allowed wait."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Web search rate limit reached, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+class DuckDuckGoBackend:
+    """Searches DuckDuckGo through LangChain's DuckDuckGoSearchRun."""
+
+    def __init__(self):
+        self._search = None
+
+    def search(self, query: str) -> str:
+        if self._search is None:
+            from langchain_community.tools import DuckDuckGoSearchRun
+            self._search = DuckDuckGoSearchRun()
+        return self._search.run(query)
+
+class StubBackend:
+    """Answers from a dict of canned results, for tests and offline runs."""
+
+    def __init__(self, results: dict | None = None, default: str = "No web results available.", delay: float = 0.0):
+        self.results = {normalize_query(query): result for query, result in (results or {}).items()}
+        self.default = default
+        self.delay = delay
+        self.calls = 0
+
+    def search(self, query: str) -> str:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.results.get(normalize_query(query), self.default)
+
+BACKENDS = {"duckduckgo": DuckDuckGoBackend, "stub": StubBackend}
+
+class TokenBucket:
+    """Token bucket whose state lives in SQLite, shared by all processes using the same file.
+
+    Refills at rate tokens per second up to capacity. Each search takes one token.
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float, name: str = "web_search"):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def try_acquire(self) -> float:
+        """Take a token if one is free; returns 0, or the seconds until one will be."""
+        conn = self._connect()
+        try:
+            # Locks the file, so the read-modify-write is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (self.name, tokens, now))
+            conn.execute("COMMIT")
+            return wait
+        finally:
+            conn.close()
+
+    def acquire(self, max_wait: float):
+        """Take a token, sleeping for one up to max_wait seconds in total."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise WebSearchRateLimited(wait)
+            time.sleep(wait)
+
+class WebSearch:
+    """Cached, coalesced and rate-limited searches against a backend.
+
+    search() blocks while it waits for a token, so call it from the worker
+    threads the agent runs on, not from the event loop.
+    """
+
+    def __init__(self, backend, limiter: TokenBucket, ttl_seconds: float = 900, max_entries: int = 1024,
+                 max_wait: float = 10):
+        self.backend = backend
+        self.limiter = limiter
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_wait = max_wait
+        self._results = OrderedDict()  # normalized query -> (stored_at, result)
+        self._in_flight = {}  # normalized query -> Future
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    def search(self, query: str) -> str:
+        key = normalize_query(query)
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            try:
+                self.limiter.acquire(self.max_wait)
+            except WebSearchRateLimited:
+                self.rate_limited += 1
+                raise
+            result = self.backend.search(query)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": len(self._results),
+                "in_flight": len(self._in_flight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "rate_limited": self.rate_limited,
+            }
+
+    def _join(self, key: str):
+        """(future, True) if the caller must run the search, or (future to wait on, False)."""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+                self.hits += 1
+                self._results.move_to_end(key)
+                future = Future()
+                future.set_result(entry[1])
+                return future, False
+            if key in self._in_flight:
+                self.coalesced += 1
+                return self._in_flight[key], False
+            self.misses += 1
+            future = self._in_flight[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error=None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if error is None:
+                self._results[key] = (time.monotonic(), result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        # Failures are handed to the waiting callers but never cached
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+def create_web_search(backend=None) -> WebSearch:
+    """WebSearch configured from the environment.
+
+    WEB_SEARCH_BACKEND picks "duckduckgo" (default) or "stub". WEB_SEARCH_RATE
+    tokens per second refill a bucket of WEB_SEARCH_BURST, shared through
+    WEB_SEARCH_STATE_PATH.
+    """
+    if backend is None:
+        backend = BACKENDS[os.getenv("WEB_SEARCH_BACKEND", "duckduckgo").lower()]()
+    limiter = TokenBucket(
+        os.getenv("WEB_SEARCH_STATE_PATH", DEFAULT_STATE_PATH),
+        rate=float(os.getenv("WEB_SEARCH_RATE", "0.5")),
+        capacity=float(os.getenv("WEB_SEARCH_BURST", "3"))
+    )
+    return WebSearch(
+        backend,
+        limiter,
+        ttl_seconds=float(os.getenv("WEB_SEARCH_CACHE_TTL", "900")),
+        max_entries=int(os.getenv("WEB_SEARCH_CACHE_SIZE", "1024")),
+        max_wait=float(os.getenv("WEB_SEARCH_MAX_WAIT", "10"))
+    )
@@ -1,39 +1,140 @@
 from fastapi import Request, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models.user import User
 from passlib.context import CryptContext
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+import asyncio
+import os
+import threading
+import time
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt takes ~250 ms and releases the GIL, so it runs on a few dedicated
+# threads instead of the event loop; at most this many hashes run at once
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# How long a user row is trusted before it is read from the database again
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
-    username = request.session.get("username")
-    if not username:
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the bcrypt pool, without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_pool, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the bcrypt pool, without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_pool, get_password_hash, password)
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as routes see it, without an ORM object."""
+    id: int
+    username: str
+    email: Optional[str] = None
+
+class UserCache:
+    """Small in-process TTL cache of User rows by id."""
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user id -> (stored_at, User)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user: User):
+        with self._lock:
+            self._entries[user.id] = (time.monotonic(), user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """Forget a user, e.g. on logout or after their row changed."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+user_cache = UserCache(ttl_seconds=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE)
+
+def start_session(request: Request, user: User):
+    """Store the user's id and minimal profile in the signed session cookie."""
+    request.session["user"] = {"id": user.id, "username": user.username, "email": user.email}
+    user_cache.put(user)
+
+def end_session(request: Request):
+    profile = request.session.get("user")
+    if profile:
+        user_cache.invalidate(profile["id"])
+    request.session.clear()
+
+async def load_user(db: AsyncSession, user_id: int) -> Optional[User]:
+    """The User row for an id, from the cache when it is fresh."""
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.get(User, user_id)
+        if user is not None:
+            user_cache.put(user)
+    return user
+
+async def get_current_principal(request: Request, db: AsyncSession = Depends(get_db)) -> Principal:
+    """The signed-in user; hits the database at most once per USER_CACHE_TTL."""
+    profile = request.session.get("user")
+    if not profile:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    user = db.query(User).filter(User.username == username).first()
+    user = await load_user(db, profile["id"])
+    if not user:
+        request.session.clear()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    return Principal(id=user.id, username=user.username, email=user.email)
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)) -> User:
+    """The signed-in user as a (possibly cached, detached) User row."""
+    profile = request.session.get("user")
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    user = await load_user(db, profile["id"])
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return user
 
-def get_current_user_session(
-    db: Session = Depends(get_db)
+async def get_current_user_session(
+    request: Request,
+    db: AsyncSession = Depends(get_db)
 ) -> User:
-    username = request.session.get("username")
-    if not username:
+    profile = request.session.get("user")
+    if not profile:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not authenticated",
         )
-    user = db.query(User).filter(User.username == username).first()
+    user = await load_user(db, profile["id"])
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
-    return user 
\ No newline at end of file
+    return user
@@ -0,0 +1,183 @@
+"""
+Single-flight coalescing of identical questions asked at the same time.
+
+Requests whose normalized question and document version match one already
+being answered wait for that answer instead of computing their own, so a
+burst of identical questions costs one retrieval and one generation, and
+only the first request holds an inference slot. Streams are shared too:
+every subscriber gets all events of the one running stream from the start.
+"""
+import asyncio
+
+from agent.kb_agent import answer_cache, normalize_question
+from agent.utils.metrics import COALESCED_REQUESTS
+
+class StreamCancelled(Exception):
+    """A shared stream was stopped before it finished."""
+
+class SharedStream:
+    """Events of one running agent stream, replayed to each subscriber."""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.cancelling = False  # set once the last subscriber has left
+        self._updated = asyncio.Event()
+
+    def publish(self, event):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def subscribe(self):
+        """Yield every event so far, then new ones until the stream ends."""
+        index = 0
+        while True:
+            # Taken before checking, so an event published meanwhile is not missed
+            updated = self._updated
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await updated.wait()
+
+class RequestCoalescer:
+    """Shares answers and streams between concurrent requests for the same question."""
+
+    def __init__(self):
+        self._answers = {}  # key -> asyncio.Task computing the response
+        self._streams = {}  # key -> SharedStream
+        self.answers_started = 0
+        self.answers_coalesced = 0
+        self.streams_started = 0
+        self.streams_coalesced = 0
+
+    @staticmethod
+    def key(question: str):
+        # Answers for another version of the documents must not be shared
+        return normalize_question(question), answer_cache.version
+
+    def in_flight(self, question: str) -> bool:
+        key = self.key(question)
+        return key in self._answers or key in self._streams
+
+    async def answer(self, question: str, compute):
+        """The response of compute(), or of the identical question already being answered.
+
+        compute is a coroutine function. It runs as its own task, so a caller
+        going away does not cancel it for the others.
+        """
+        key = self.key(question)
+        task = self._answers.get(key)
+        if task is not None:
+            self.answers_coalesced += 1
+            COALESCED_REQUESTS.labels("answer").inc()
+            return dict(await asyncio.shield(task))
+        shared = self._live_stream(key)
+        if shared is not None:
+            # The same question is being streamed: collect that stream
+            self.answers_coalesced += 1
+            COALESCED_REQUESTS.labels("answer").inc()
+            return await self._collect(key, shared)
+
+        task = asyncio.ensure_future(compute())
+        self._answers[key] = task
+        self.answers_started += 1
+        task.add_done_callback(lambda _: self._forget(self._answers, key, task))
+        return dict(await asyncio.shield(task))
+
+    async def stream(self, question: str, produce):
+        """Yield the events of the stream for question, starting it if none is running.
+
+        produce(shared) is a coroutine function that publishes events to the
+        SharedStream. It is cancelled once every subscriber has gone away.
+        """
+        key = self.key(question)
+        shared = self._live_stream(key)
+        if shared is None:
+            shared = SharedStream()
+            self._streams[key] = shared
+            self.streams_started += 1
+            shared.task = asyncio.ensure_future(self._produce(shared, produce))
+            shared.task.add_done_callback(lambda _: self._forget(self._streams, key, shared))
+        else:
+            self.streams_coalesced += 1
+            COALESCED_REQUESTS.labels("stream").inc()
+
+        shared.subscribers += 1
+        try:
+            async for event in shared.subscribe():
+                yield event
+        finally:
+            self._leave(key, shared)
+
+    def stats(self) -> dict:
+        return {
+            "answers_in_flight": len(self._answers),
+            "answers_started": self.answers_started,
+            "answers_coalesced": self.answers_coalesced,
+            "streams_in_flight": len(self._streams),
+            "streams_started": self.streams_started,
+            "streams_coalesced": self.streams_coalesced,
+        }
+
+    def _live_stream(self, key) -> SharedStream | None:
+        shared = self._streams.get(key)
+        return None if shared is None or shared.cancelling else shared
+
+    def _leave(self, key, shared: SharedStream):
+        """Drop a subscriber; the last one out stops the stream."""
+        shared.subscribers -= 1
+        if shared.subscribers == 0 and not shared.done:
+            # Forget it before cancelling, so no new request joins a dying stream
+            shared.cancelling = True
+            self._forget(self._streams, key, shared)
+            shared.task.cancel()
+
+    async def _produce(self, shared: SharedStream, produce):
+        try:
+            await produce(shared)
+        except asyncio.CancelledError:
+            # Subscribers get an ordinary error; CancelledError would get past
+            # the request handlers' error handling
+            shared.finish(StreamCancelled("The answer stream was stopped"))
+            raise
+        except Exception as e:
+            shared.finish(e)
+        else:
+            shared.finish()
+
+    async def _collect(self, key, shared: SharedStream) -> dict:
+        sources = []
+        answer_parts = []
+        shared.subscribers += 1
+        try:
+            async for kind, payload in shared.subscribe():
+                if kind == "sources":
+                    sources = payload
+                else:
+                    answer_parts.append(payload)
+        finally:
+            self._leave(key, shared)
+        return {"answer": "".join(answer_parts), "sources": sources}
+
+    @staticmethod
+    def _forget(entries: dict, key, value):
+        if entries.get(key) is value:
+            del entries[key]
+
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,111 @@
+"""
+Bounded executor for running the blocking KB agent off the event loop.
+"""
+import asyncio
+import contextvars
+import functools
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+from agent.utils.metrics import observe
+
+load_dotenv()
+
+# How many answers may be generated at once, and how many may wait for a slot
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "2"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+
+class InferenceQueueFull(Exception):
+    """Raised when every slot is busy and the wait queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class InferenceExecutor:
+    """Run agent calls on a dedicated thread pool with a concurrency cap and a bounded queue.
+
+    All bookkeeping happens on the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, max_concurrency: int = INFERENCE_CONCURRENCY, max_queue: int = INFERENCE_QUEUE_SIZE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="inference")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    def retry_after(self) -> int:
+        """Estimate in seconds when a slot should be free again."""
+        avg_run = self.total_run_seconds / self.completed if self.completed else 30.0
+        return max(1, math.ceil(avg_run * (self.queued + 1) / self.max_concurrency))
+
+    def check_capacity(self):
+        """Raise InferenceQueueFull right away if a new job could not even be queued."""
+        if self.running >= self.max_concurrency and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise InferenceQueueFull(self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one inference slot, waiting in the queue if needed."""
+        self.check_capacity()
+        self.queued += 1
+        queued_at = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        wait = time.perf_counter() - queued_at
+        observe("queue_wait", wait)
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+        self.running += 1
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.total_run_seconds += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    async def call(self, fn, *args, **kwargs):
+        """Run fn on the inference pool. The caller must already hold a slot."""
+        loop = asyncio.get_running_loop()
+        # Carry the request's context over, so its spans are collected on the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._pool, functools.partial(context.run, fn, *args, **kwargs))
+
+    async def run(self, fn, *args, **kwargs):
+        """Wait for a slot, then run fn on the inference pool."""
+        async with self.slot():
+            return await self.call(fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        """Queue depth and wait time figures for the stats endpoint."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait_seconds / self.completed if self.completed else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+            "avg_run_seconds": self.total_run_seconds / self.completed if self.completed else 0.0,
+        }
+
+inference_executor = InferenceExecutor()
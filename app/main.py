@@ -1,20 +1,27 @@
-from fastapi import FastAPI, Request, Form, HTTPException, Depends, status
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Depends, status
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from passlib.context import CryptContext
-from typing import Optional
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from agent.kb_agent import run_custom_agent
-from app.database import get_db, engine
-from app.models.user import User, Base
-from app.routers import auth, chat
-from app.auth.auth import get_current_user
+from agent.kb_agent import run_custom_agent, plan_batch, answer_group, BATCH_CONCURRENCY
+from app.database import init_db
+from app.routers import auth, chat, system
+from app.auth.auth import Principal, get_current_principal
 from pathlib import Path
 from starlette.middleware.sessions import SessionMiddleware
+import asyncio
+import functools
+import json
+import os
 import secrets
-from app.shared import tools, llm, retriever  # Import shared components
+from app.shared import agent_state
+from app.inference import inference_executor, InferenceQueueFull
+from app.coalescing import request_coalescer
+from app.metrics import SERVER_TIMING, ServerTimingMiddleware, metrics_response
+
+# Largest batch /ask/batch accepts
+ASK_BATCH_MAX_SIZE = int(os.getenv("ASK_BATCH_MAX_SIZE", "256"))
 
 app = FastAPI()
 
@@ -31,8 +38,8 @@ app.mount(
 )
 
 app.add_middleware(SessionMiddleware, secret_key=secrets.token_hex(32))
-# Create database tables
-Base.metadata.create_all(bind=engine)
+if SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -40,9 +47,24 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 class Question(BaseModel):
     question: str
 
+class QuestionBatch(BaseModel):
+    questions: list[str]
+    stream: bool = False
+
+@app.on_event("startup")
+async def create_tables():
+    # Create database tables
+    await init_db()
+
+@app.on_event("startup")
+async def start_agent():
+    # Initialize the KB agent in the background so the port binds right away
+    agent_state.start()
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(chat.router, prefix="/api", tags=["chat"])
+app.include_router(system.router, prefix="/system", tags=["system"])
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -53,20 +75,41 @@ async def welcome(request: Request, username: str):
     return templates.TemplateResponse("welcome.html", {"request": request, "username": username})
 
 @app.get("/chat", response_class=HTMLResponse)
-async def chat(request: Request, current_user: User = Depends(get_current_user)):
+async def chat(request: Request, current_user: Principal = Depends(get_current_principal)):
     return templates.TemplateResponse("chat.html", {"request": request, "username": current_user.username})
 
+@app.get("/healthz")
+async def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency, routes, LLM tokens and throughput."""
+    return metrics_response()
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once the KB agent can answer questions."""
+    return JSONResponse(
+        status_code=200 if agent_state.ready else 503,
+        content=agent_state.status()
+    )
+
 @app.post("/ask")
 async def ask_question_post(question: Question):
     """POST endpoint for the question-answering functionality."""
-    if not tools or not llm or not retriever:
+    if not agent_state.ready:
         return JSONResponse(
-            status_code=500,
-            content={"error": "Knowledge Base Agent is not properly initialized"}
+            status_code=503,
+            content={"error": "Knowledge Base Agent is still starting up"},
+            headers={"Retry-After": str(int(agent_state.next_retry_in or 5))}
         )
     
     try:
-        response = run_custom_agent(question.question, tools, llm, retriever)
+        response = await request_coalescer.answer(question.question, functools.partial(
+            inference_executor.run, run_custom_agent, question.question, *agent_state.components()
+        ))
         
         # Ensure answer and sources are always separated
         if isinstance(response, dict):
@@ -80,20 +123,101 @@ async def ask_question_post(question: Question):
             "answer": answer,
             "sources": sources
         })
+    except InferenceQueueFull as e:
+        return JSONResponse(
+            status_code=503,
+            content={"error": "The AI system is busy. Please try again shortly."},
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": f"Error processing question: {str(e)}"}
         )
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
-    username = request.session.get("username")
-    if not username:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+def batch_result(index: int, response) -> dict:
+    if "error" in response:
+        return {"index": index, "error": response["error"]}
+    answer = response.get("answer", "")
+    return {
+        "index": index,
+        "answer": answer.content if hasattr(answer, "content") else answer,
+        "sources": response.get("sources", [])
+    }
+
+async def answer_batch_groups(groups):
+    """Yield (index, response) as groups finish, holding at most BATCH_CONCURRENCY inference slots."""
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(group):
+        async with semaphore:
+            try:
+                return await inference_executor.run(answer_group, group, *agent_state.components())
+            except InferenceQueueFull:
+                error = "The AI system is busy. Please try again shortly."
+            except Exception as e:
+                error = f"Error processing question: {str(e)}"
+            return [(item.index, {"error": error}) for item in group]
+
+    tasks = [asyncio.create_task(answer(group)) for group in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for index, response in await next_done:
+                yield index, response
+    finally:
+        # The client went away: stop the groups that have not started
+        for task in tasks:
+            task.cancel()
+
+@app.post("/ask/batch")
+async def ask_batch(batch: QuestionBatch):
+    """Answer many questions in one call.
+
+    Questions are embedded and searched together, and those sharing the same
+    context are generated back to back. Returns {"results": [...]} in
+    question order, or with "stream": true one NDJSON line per question as
+    soon as it is answered. Each result carries its question's "index".
+    """
+    if not agent_state.ready:
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Knowledge Base Agent is still starting up"},
+            headers={"Retry-After": str(int(agent_state.next_retry_in or 5))}
+        )
+    if len(batch.questions) > ASK_BATCH_MAX_SIZE:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"A batch may hold at most {ASK_BATCH_MAX_SIZE} questions"}
+        )
+
+    try:
+        cached, groups = await inference_executor.run(plan_batch, batch.questions, agent_state.retriever)
+    except InferenceQueueFull as e:
+        return JSONResponse(
+            status_code=503,
+            content={"error": "The AI system is busy. Please try again shortly."},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error processing questions: {str(e)}"}
+        )
+
+    if batch.stream:
+        async def lines():
+            for index, response in cached.items():
+                yield json.dumps(batch_result(index, response)) + "\n"
+            async for index, response in answer_batch_groups(groups):
+                yield json.dumps(batch_result(index, response)) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    results = [None] * len(batch.questions)
+    for index, response in cached.items():
+        results[index] = batch_result(index, response)
+    async for index, response in answer_batch_groups(groups):
+        results[index] = batch_result(index, response)
+    return JSONResponse(content={"results": results})
 
 @app.exception_handler(HTTPException)
 async def custom_http_exception_handler(request: Request, exc: HTTPException):
@@ -103,5 +227,6 @@ async def custom_http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None),
     )
 
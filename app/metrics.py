@@ -0,0 +1,48 @@
+"""
+Prometheus metrics endpoint and the optional Server-Timing header.
+
+The stage spans themselves are recorded by agent.utils.metrics; this module
+adds the inference queue gauges and exposes everything over HTTP.
+"""
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, generate_latest
+from starlette.datastructures import MutableHeaders
+from starlette.responses import Response
+
+from agent.utils.metrics import collect_spans, server_timing
+from app.inference import inference_executor
+
+# Add a Server-Timing header with the stage durations to every response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+Gauge("tako_inference_queue_depth", "Requests waiting for an inference slot").set_function(lambda: inference_executor.queued)
+Gauge("tako_inference_running", "Requests holding an inference slot").set_function(lambda: inference_executor.running)
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+class ServerTimingMiddleware:
+    """Adds a Server-Timing header with the stage spans of each request.
+
+    Streaming responses send their headers before the answer is generated,
+    so they only carry the stages that finished before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started_at = time.perf_counter()
+        with collect_spans() as spans:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    timings = spans + [("total", time.perf_counter() - started_at)]
+                    MutableHeaders(scope=message).append("Server-Timing", server_timing(timings))
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
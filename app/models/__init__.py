@@ -0,0 +1,10 @@
+"""
+Database models.
+
+Every model module is imported here, so relationship() targets such as
+"User" resolve and init_db creates every table, whichever model a module
+imports first.
+"""
+from . import chat, user
+
+__all__ = ["chat", "user"]
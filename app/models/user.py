@@ -11,8 +11,4 @@ class User(Base):
     password = Column(String(255))
 
     # Relationships
-    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan")
-
-# Create tables
-from app.database import engine
-Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan") 
\ No newline at end of file
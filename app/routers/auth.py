@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Request, Form, Depends, HTTPException, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from app.auth.auth import verify_password, get_password_hash
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.auth.auth import verify_password_async, get_password_hash_async, start_session, end_session
 from app.database import get_db
 from app.models.user import User
 from pydantic import BaseModel
@@ -28,20 +29,20 @@ async def login_page(request: Request, error: str = None, success: str = None):
     )
 
 @router.post("/login", response_class=HTMLResponse)
-async def login(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def login(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         return templates.TemplateResponse(
             "login.html",
             {"request": request, "error": "User does not exist. Please check your username or register."}
         )
-    if not verify_password(password, user.password):
+    if not await verify_password_async(password, user.password):
         return templates.TemplateResponse(
             "login.html",
             {"request": request, "error": "Incorrect password. Please try again."}
         )
     # Set the session
-    request.session["username"] = user.username
+    start_session(request, user)
     return RedirectResponse(url=f"/welcome?username={user.username}", status_code=303)
 
 @router.get("/register", response_class=HTMLResponse)
@@ -55,7 +56,7 @@ async def register(
     email: str = Form(...),
     password: str = Form(...),
     confirm_password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Check if passwords match
     if password != confirm_password:
@@ -64,22 +65,23 @@ async def register(
             {"request": request, "error": "Passwords do not match"}
         )
     
-    # Check if username already exists
-    if db.query(User).filter(User.username == username).first():
+    # Check if username or email already exists, in one query
+    existing = (await db.execute(
+        select(User.username, User.email).where(or_(User.username == username, User.email == email)).limit(2)
+    )).all()
+    if any(row.username == username for row in existing):
         return templates.TemplateResponse(
             "register.html",
             {"request": request, "error": "Username already registered"}
         )
-    
-    # Check if email already exists
-    if db.query(User).filter(User.email == email).first():
+    if existing:
         return templates.TemplateResponse(
             "register.html",
             {"request": request, "error": "Email already registered"}
         )
     
     # Create new user
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash_async(password)
     new_user = User(
         username=username,
         email=email,
@@ -87,14 +89,14 @@ async def register(
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     
     # Redirect to login page with success message
     return RedirectResponse(url="/login?success=Registration successful. Please log in.", status_code=303)
 
 @router.get("/logout")
-async def logout():
+async def logout(request: Request):
+    end_session(request)
     return RedirectResponse(
         url="/login?success=You have been successfully logged out.",
         status_code=303
@@ -1,106 +1,163 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Form
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Form, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from typing import List, Optional
-from langchain_community.chat_models import ChatOllama
 from app.database import get_db
 from app.models.chat import Conversation, Message
-from app.schemas.chat import ChatRequest, Conversation as ConversationSchema, Message as MessageSchema
-from app.auth.auth import get_current_user
-from app.models.user import User
-from agent.kb_agent import run_custom_agent
-from langchain.chains import RetrievalQA
+from app.schemas.chat import Conversation as ConversationSchema, ConversationPage, ConversationSummary, Message as MessageSchema
+from app.auth.auth import Principal, get_current_principal
+from agent.kb_agent import run_custom_agent, stream_custom_agent
+from contextlib import aclosing
 from datetime import datetime
-from starlette.middleware.sessions import SessionMiddleware
-from app.shared import tools, llm, retriever  # Import from shared module
+import base64
+import functools
+import json
+import logging
+import threading
+from app.shared import agent_state
+from app.inference import inference_executor, InferenceQueueFull
+from app.titles import generate_conversation_title
+from app.coalescing import request_coalescer
+from agent.utils.metrics import span
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-def generate_title(message: str) -> str:
-    """Generate a title for the conversation using Ollama."""
+# Characters of the last message shown in the conversation list
+PREVIEW_LENGTH = 120
+
+async def start_user_turn(db: AsyncSession, conversation_id: Optional[int], current_user: Principal, message: str) -> Conversation:
+    """Get or create the conversation and store the user's message in it."""
+    # Get or create conversation
     try:
-        prompt = f"""Generate a short, concise title (max 5 words) for this conversation based on the first message.
-        Message: {message}
-        Title:"""
-        
-        response = llm.invoke(prompt)
-        title = response.content.strip()
-        
-        # Clean up the title (remove quotes, extra spaces, etc.)
-        title = title.replace('"', '').replace("'", "").strip()
-        
-        # If the title is too long, take the first 5 words
-        words = title.split()
-        if len(words) > 5:
-            title = " ".join(words[:5])
-            
-        return title if title else "New Conversation"
-    except Exception as e:
-        return "New Conversation"
+        if conversation_id:
+            conversation = await db.scalar(select(Conversation).where(
+                Conversation.id == conversation_id,
+                Conversation.user_id == current_user.id
+            ))
+            if not conversation:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+        else:
+            conversation = Conversation(
+                user_id=current_user.id,
+                created_at=datetime.utcnow()
+            )
+            db.add(conversation)
+            with span("db_write"):
+                await db.commit()
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("could not load or create conversation %s", conversation_id)
+        raise HTTPException(
+            status_code=500,
+            detail="Error accessing conversation history. Please try again."
+        )
+
+    # Create user message
+    try:
+        user_message = Message(
+            conversation_id=conversation.id,
+            content=message,
+            role="user"
+        )
+        db.add(user_message)
+        # Keeps the conversation list ordered by activity
+        conversation.updated_at = datetime.utcnow()
+        with span("db_write"):
+            await db.commit()
+    except Exception:
+        logger.exception("could not save the user message")
+        raise HTTPException(
+            status_code=500,
+            detail="Error saving your message. Please try again."
+        )
+    return conversation
+
+async def save_assistant_message(db: AsyncSession, conversation: Conversation, answer: str, sources) -> Message:
+    """Store the assistant's answer in the conversation."""
+    try:
+        ai_message = Message(
+            conversation_id=conversation.id,
+            content=answer,
+            role="assistant",
+            sources=sources
+        )
+        db.add(ai_message)
+        conversation.updated_at = datetime.utcnow()
+        with span("db_write"):
+            await db.commit()
+        return ai_message
+    except Exception:
+        logger.exception("could not save the assistant message")
+        raise HTTPException(
+            status_code=500,
+            detail="Error saving the AI response. Please try again."
+        )
+
+def check_agent_ready():
+    """503 while the KB agent is still starting up."""
+    if not agent_state.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="The AI system is still starting up. Please try again in a few moments.",
+            headers={"Retry-After": str(int(agent_state.next_retry_in or 5))}
+        )
+
+def check_capacity(message: str):
+    """503 right away if the queue is full, unless the question is already being answered."""
+    if request_coalescer.in_flight(message):
+        return
+    try:
+        inference_executor.check_capacity()
+    except InferenceQueueFull as e:
+        raise busy_error(e)
+
+def busy_error(exc: InferenceQueueFull) -> HTTPException:
+    """503 telling the client when to retry."""
+    return HTTPException(
+        status_code=503,
+        detail="The AI system is busy. Please try again shortly.",
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 @router.post("/chat")
 async def chat(
     request: Request,
+    background_tasks: BackgroundTasks,
     message: str = Form(...),
     conversation_id: Optional[int] = Form(None),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Handle chat messages and return AI responses."""
     try:
         # Check if KB Agent components are initialized
-        if not tools or not llm or not retriever:
-            raise HTTPException(
-                status_code=500,
-                detail="The AI system is not properly initialized. Please try again in a few moments."
-            )
+        check_agent_ready()
+        tools, llm, retriever = agent_state.components()
 
-        # Get or create conversation
-        try:
-            if conversation_id:
-                conversation = db.query(Conversation).filter(
-                    Conversation.id == conversation_id,
-                    Conversation.user_id == current_user.id
-                ).first()
-                if not conversation:
-                    raise HTTPException(status_code=404, detail="Conversation not found")
-            else:
-                conversation = Conversation(
-                    user_id=current_user.id,
-                    created_at=datetime.utcnow()
-                )
-                db.add(conversation)
-                db.commit()
-                db.refresh(conversation)
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail="Error accessing conversation history. Please try again."
-            )
+        # Fail fast before storing anything if the queue is already full
+        check_capacity(message)
 
-        # Create user message
-        try:
-            user_message = Message(
-                conversation_id=conversation.id,
-                content=message,
-                role="user"
-            )
-            db.add(user_message)
-            db.commit()
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail="Error saving your message. Please try again."
-            )
+        conversation = await start_user_turn(db, conversation_id, current_user, message)
 
-        # Get AI response
+        # Get AI response, shared with identical questions being answered right now
         try:
-            response = run_custom_agent(
+            response = await request_coalescer.answer(message, functools.partial(
+                inference_executor.run,
+                run_custom_agent,
                 message,
                 tools,
                 llm,
                 retriever
-            )
-        except Exception as e:
+            ))
+        except InferenceQueueFull as e:
+            raise busy_error(e)
+        except Exception:
+            logger.exception("answering failed")
             raise HTTPException(
                 status_code=500,
                 detail="The AI system encountered an error while processing your question. Please try rephrasing your question or try again later."
@@ -147,71 +204,19 @@ async def chat(
             if not answer:
                 raise ValueError("Empty response from AI system")
 
-        except Exception as e:
-            import traceback
+        except Exception:
+            logger.exception("could not read the answer from %r", response)
             raise HTTPException(
                 status_code=500,
                 detail="Error processing the AI response. Please try again."
             )
 
         # Create AI message
-        try:
-            ai_message = Message(
-                conversation_id=conversation.id,
-                content=answer,
-                role="assistant",
-                sources=sources
-            )
-            db.add(ai_message)
-            db.commit()
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail="Error saving the AI response. Please try again."
-            )
+        await save_assistant_message(db, conversation, answer, sources)
 
-        # Generate title if this is the first message
-        msg_count = db.query(Message).filter(Message.conversation_id == conversation.id).count()
-        if msg_count == 2:
-            try:
-                title_prompt = f"Generate a short, concise title (max 5 words) for this conversation: {message}"
-                title_response = run_custom_agent(title_prompt, tools, llm, retriever)
-
-                # Extract just the title text from the response
-                if isinstance(title_response, dict):
-                    title = title_response.get('answer', '')
-                    # If the answer is an AIMessage, extract its content
-                    if hasattr(title, 'content'):
-                        title = title.content
-                elif hasattr(title_response, 'content'):
-                    title = title_response.content
-                else:
-                    title = str(title_response)
-                    
-                # Clean up the title
-                title = title.replace('"', '').replace("'", "").strip()
-                # Remove any content= prefix if present
-                title = title.replace('content=', '').strip()
-                # Remove any additional_kwargs or response_metadata if present
-                title = title.split('additional_kwargs')[0].strip()
-                
-                # If the title is too long, take the first 5 words
-                words = title.split()
-                if len(words) > 5:
-                    title = " ".join(words[:5])
-                    
-                # Ensure title is not empty
-                if not title:
-                    title = "New Conversation"
-                    
-                # Truncate to 100 characters to ensure it fits in the database
-                title = title[:100]
-                
-                conversation.title = title
-                db.commit()
-            except Exception as e:
-                conversation.title = "New Conversation"
-                db.commit()
+        # Title new conversations after the response is sent
+        if not conversation_id:
+            background_tasks.add_task(generate_conversation_title, conversation.id, message)
 
         return {
             "conversation_id": conversation.id,
@@ -221,32 +226,178 @@ async def chat(
 
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
+        logger.exception("chat request failed")
         raise HTTPException(
             status_code=500,
             detail="An unexpected error occurred. Please try again later."
         )
 
-@router.get("/conversations", response_model=List[ConversationSchema])
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_agent_events(message, tools, llm, retriever, shared):
+    """Run stream_custom_agent on the inference pool, publishing its events to a SharedStream.
+
+    The whole stream holds one inference slot.
+    """
+    events = stream_custom_agent(message, tools, llm, retriever)
+    # next() runs in a worker thread; the lock keeps close() from racing it
+    events_lock = threading.Lock()
+
+    def next_event():
+        with events_lock:
+            return next(events, None)
+
+    def close_events():
+        with events_lock:
+            events.close()
+
+    try:
+        async with inference_executor.slot():
+            while True:
+                event = await inference_executor.call(next_event)
+                if event is None:
+                    return
+                shared.publish(event)
+    finally:
+        # Closing the generator closes the Ollama request. Done on a plain
+        # thread because this may run while the task is being cancelled.
+        threading.Thread(target=close_events, daemon=True).start()
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    message: str = Form(...),
+    conversation_id: Optional[int] = Form(None),
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream the AI response as Server-Sent Events.
+
+    Events: "conversation" (id), "sources", "token" (repeated), then "done"
+    with the stored message id, or "error".
+    """
+    check_agent_ready()
+    tools, llm, retriever = agent_state.components()
+    check_capacity(message)
+
+    conversation = await start_user_turn(db, conversation_id, current_user, message)
+    # Identical questions streamed right now share one generation
+    produce = functools.partial(stream_agent_events, message, tools, llm, retriever)
+
+    async def event_stream():
+        answer_parts = []
+        sources = []
+        yield sse_event("conversation", {"conversation_id": conversation.id})
+        try:
+            async with aclosing(request_coalescer.stream(message, produce)) as events:
+                async for kind, payload in events:
+                    # Stop listening as soon as the client is gone; the
+                    # generation stops once no one is listening anymore
+                    if await request.is_disconnected():
+                        return
+                    if kind == "sources":
+                        sources = payload
+                    else:
+                        answer_parts.append(payload)
+                    yield sse_event(kind, payload)
+        except InferenceQueueFull as e:
+            yield sse_event("error", {"detail": "The AI system is busy. Please try again shortly.", "retry_after": e.retry_after})
+            return
+        except Exception:
+            logger.exception("streaming answer failed")
+            yield sse_event("error", {
+                "detail": "The AI system encountered an error while processing your question. Please try rephrasing your question or try again later."
+            })
+            return
+
+        answer = "".join(answer_parts)
+        if not answer:
+            yield sse_event("error", {"detail": "Error processing the AI response. Please try again."})
+            return
+        try:
+            ai_message = await save_assistant_message(db, conversation, answer, sources)
+        except HTTPException as e:
+            yield sse_event("error", {"detail": e.detail})
+            return
+        yield sse_event("done", {"conversation_id": conversation.id, "message_id": ai_message.id})
+
+    # Title new conversations once the stream has finished
+    if not conversation_id:
+        background_tasks.add_task(generate_conversation_title, conversation.id, message)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks
+    )
+
+def encode_cursor(updated_at: datetime, conversation_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{conversation_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    """(updated_at, id) of the last conversation of the previous page."""
+    try:
+        updated_at, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def list_conversation_summaries(db: AsyncSession, user_id: int, limit: int, cursor: Optional[str]):
+    """One page of conversation summaries, most recently active first, in a single query.
+
+    The page is picked by keyset on (updated_at, id) first, and messages are
+    counted only for the conversations on it, so a page costs the same
+    however long the user's history is.
+    """
+    page = select(Conversation.id, Conversation.title, Conversation.updated_at).where(Conversation.user_id == user_id)
+    if cursor:
+        updated_at, conversation_id = decode_cursor(cursor)
+        page = page.where(or_(
+            Conversation.updated_at < updated_at,
+            and_(Conversation.updated_at == updated_at, Conversation.id < conversation_id)
+        ))
+    page = page.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1).subquery()
+
+    message_count = select(func.count(Message.id)).where(Message.conversation_id == page.c.id).scalar_subquery()
+    last_message_preview = select(func.substr(Message.content, 1, PREVIEW_LENGTH)).where(
+        Message.conversation_id == page.c.id
+    ).order_by(Message.id.desc()).limit(1).scalar_subquery()
+
+    rows = (await db.execute(select(
+        page.c.id,
+        page.c.title,
+        page.c.updated_at,
+        message_count.label("message_count"),
+        last_message_preview.label("last_message_preview")
+    ).order_by(page.c.updated_at.desc(), page.c.id.desc()))).all()
+    next_cursor = encode_cursor(rows[limit - 1].updated_at, rows[limit - 1].id) if len(rows) > limit else None
+    return ConversationPage(
+        conversations=[ConversationSummary(**row._asdict()) for row in rows[:limit]],
+        next_cursor=next_cursor
+    )
+
+@router.get("/conversations", response_model=ConversationPage)
 async def get_conversations(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all conversations for the current user."""
+    """List the current user's conversations, most recently active first.
+
+    Returns summaries only; messages are loaded per conversation. Pass the
+    returned next_cursor to get the following page.
+    """
     try:
-        # Get conversations ordered by most recent
-        conversations = db.query(Conversation).filter(
-            Conversation.user_id == current_user.id
-        ).order_by(Conversation.updated_at.desc()).all()
-        
-        # Ensure all conversations have a title
-        for conv in conversations:
-            if not conv.title:
-                conv.title = "New Conversation"
-                db.commit()
-        
-        return conversations
-    except Exception as e:
+        return await list_conversation_summaries(db, current_user.id, limit, cursor)
+    except HTTPException:
+        raise
+    except Exception:
         raise HTTPException(
             status_code=500,
             detail="Error retrieving conversations"
@@ -255,57 +406,92 @@ async def get_conversations(
 @router.get("/conversations/{conversation_id}", response_model=ConversationSchema)
 async def get_conversation(
     conversation_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get a specific conversation by ID."""
     try:
-        conversation = db.query(Conversation).filter(
+        conversation = await db.scalar(select(Conversation).options(selectinload(Conversation.messages)).where(
             Conversation.id == conversation_id,
             Conversation.user_id == current_user.id
-        ).first()
+        ))
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
         # Ensure conversation has a title
         if not conversation.title:
             conversation.title = "New Conversation"
-            db.commit()
+            await db.commit()
         
         return conversation
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
         raise HTTPException(
             status_code=500,
             detail="Error retrieving conversation"
         )
 
+async def list_messages(db: AsyncSession, conversation_id: int, limit: int, before: Optional[int], after: Optional[int]):
+    """One page of messages in chronological order.
+
+    Without a cursor this is the most recent page. Paging is keyset on
+    (created_at, id), starting from the created_at of the cursor message.
+    """
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    cursor_id = before or after
+    if cursor_id:
+        cursor_time = select(Message.created_at).where(
+            Message.id == cursor_id,
+            Message.conversation_id == conversation_id
+        ).scalar_subquery()
+        if before:
+            query = query.where(or_(
+                Message.created_at < cursor_time,
+                and_(Message.created_at == cursor_time, Message.id < cursor_id)
+            ))
+        else:
+            query = query.where(or_(
+                Message.created_at > cursor_time,
+                and_(Message.created_at == cursor_time, Message.id > cursor_id)
+            ))
+
+    if after:
+        return (await db.scalars(query.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit))).all()
+    messages = (await db.scalars(query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit))).all()
+    return messages[::-1]
+
 @router.get("/conversations/{conversation_id}/messages", response_model=List[MessageSchema])
 async def get_conversation_messages(
     conversation_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all messages for a specific conversation."""
+    """Get a page of messages for a specific conversation, oldest first.
+
+    Returns the latest `limit` messages, or those just before/after the
+    message with id `before`/`after`. Fewer than `limit` means there are
+    no more in that direction.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
     try:
         # Verify conversation belongs to user
-        conversation = db.query(Conversation).filter(
+        conversation = await db.scalar(select(Conversation.id).where(
             Conversation.id == conversation_id,
             Conversation.user_id == current_user.id
-        ).first()
+        ))
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
-        
-        # Get messages
-        messages = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at.asc()).all()
-        return messages
+
+        return await list_messages(db, conversation_id, limit, before, after)
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
         raise HTTPException(
             status_code=500,
             detail="Error retrieving messages"
-        ) 
\ No newline at end of file
+        )
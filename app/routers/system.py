@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from app.coalescing import request_coalescer
+from app.inference import inference_executor
+from app.shared import agent_state
+from agent.kb_agent import answer_cache, context_assembler, reranker
+from agent.utils.embedding_cache import embedding_cache_stats
+from agent.utils.ollama_client import pool_stats
+
+router = APIRouter()
+
+@router.get("/stats")
+async def get_stats():
+    """Runtime statistics for the inference pipeline."""
+    return {
+        "agent": agent_state.status(),
+        "inference": inference_executor.stats(),
+        "coalescing": request_coalescer.stats(),
+        "answer_cache": answer_cache.stats(),
+        "rerank": reranker.stats(),
+        "context": context_assembler.stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "ollama": pool_stats(),
+        "web_search": agent_state.web_search.stats() if agent_state.web_search else None
+    }
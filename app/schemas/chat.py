@@ -40,6 +40,18 @@ class Conversation(ConversationBase):
     class Config:
         from_attributes = True
 
+class ConversationSummary(BaseModel):
+    """A conversation as listed in the sidebar, without its messages."""
+    id: int
+    title: Optional[str] = None
+    updated_at: datetime
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+
+class ConversationPage(BaseModel):
+    conversations: List[ConversationSummary]
+    next_cursor: Optional[str] = None  # pass back as ?cursor= for the next page
+
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[int] = None 
\ No newline at end of file
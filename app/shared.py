@@ -1,21 +1,97 @@
 """
 Shared components and initialization logic for the application.
+
+The KB agent is initialized on a background thread, so the server binds its
+port immediately and answers health checks while Ollama and the vector store
+come up. Failed attempts are retried with exponential backoff.
 """
-from agent.kb_agent import initialize_ollama, initialize_embeddings, create_retriever_tool, create_web_search_tool
-from langchain_community.chat_models import ChatOllama
+import os
+import threading
+import time
+
+from agent.kb_agent import initialize_embeddings, create_retriever_tool, create_web_search_tool
+from agent.utils import DocumentRetriever, check_ollama_availability, check_and_pull_model
+from agent.utils.web_search import create_web_search
+from agent.utils.ollama_client import CHAT_MODEL, PooledChatOllama
 from langchain.chains import RetrievalQA
 
-# Initialize KB Agent components
-try:
-    initialize_ollama()
-    vectorstore = initialize_embeddings()
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-    llm = ChatOllama(model="llama2", temperature=0)
-    retrieval_chain = RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
-    retriever_tool = create_retriever_tool(retrieval_chain)
-    web_search_tool = create_web_search_tool()
-    tools = [retriever_tool, web_search_tool]
-except Exception as e:
-    tools = None
-    llm = None
-    retriever = None 
\ No newline at end of file
+# Backoff between initialization attempts, in seconds
+INIT_RETRY_INITIAL = float(os.getenv("AGENT_INIT_RETRY_INITIAL", "1"))
+INIT_RETRY_MAX = float(os.getenv("AGENT_INIT_RETRY_MAX", "60"))
+
+# A BM25 hit this strong, and this far ahead of the next, skips the query embedding
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "5.0"))
+LEXICAL_DECISIVE_RATIO = float(os.getenv("LEXICAL_DECISIVE_RATIO", "1.5"))
+
+class AgentState:
+    """Holds the KB agent components once they are ready."""
+
+    def __init__(self):
+        self.tools = None
+        self.llm = None
+        self.retriever = None
+        self.web_search = None
+        self.ready = False
+        self.attempts = 0
+        self.last_error = None
+        self.next_retry_in = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start initializing in the background (no-op if already started)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="agent-init", daemon=True)
+                self._thread.start()
+
+    def components(self):
+        """The (tools, llm, retriever) triple the agent functions take."""
+        return self.tools, self.llm, self.retriever
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "next_retry_in": self.next_retry_in,
+        }
+
+    def _run(self):
+        delay = INIT_RETRY_INITIAL
+        while not self.ready:
+            self.attempts += 1
+            try:
+                self._initialize()
+                self.last_error = None
+                self.next_retry_in = None
+            except Exception as e:
+                self.last_error = str(e)
+                self.next_retry_in = delay
+                time.sleep(delay)
+                delay = min(delay * 2, INIT_RETRY_MAX)
+
+    def _initialize(self):
+        if not check_ollama_availability():
+            raise RuntimeError("Ollama is not running")
+        check_and_pull_model()
+        vectorstore = initialize_embeddings()
+        # The agent searches once per question and answers from those documents
+        retriever = DocumentRetriever(
+            vectorstore,
+            k=10,
+            lexical_min_score=LEXICAL_MIN_SCORE,
+            lexical_ratio=LEXICAL_DECISIVE_RATIO
+        )
+        llm = PooledChatOllama(model=CHAT_MODEL, temperature=0)
+        retrieval_chain = RetrievalQA.from_chain_type(llm=llm, retriever=vectorstore.as_retriever(search_kwargs={"k": 10}))
+        retriever_tool = create_retriever_tool(retrieval_chain)
+        web_search = self.web_search or create_web_search()
+        web_search_tool = create_web_search_tool(web_search)
+        self.web_search = web_search
+        self.tools = [retriever_tool, web_search_tool]
+        self.llm = llm
+        self.retriever = retriever
+        self.ready = True
+
+agent_state = AgentState()
@@ -0,0 +1,88 @@
+"""
+Conversation titles, generated in the background after the first answer is sent.
+
+An extractive title built from the first question's keywords is tried first.
+Only when that yields too little, and TITLE_USE_LLM is set, a short,
+token-capped LLM call is made through the inference executor.
+"""
+import os
+import re
+
+
+from agent.utils.lexical_index import STOP_WORDS
+from agent.utils.metrics import span
+from agent.utils.ollama_client import PooledChatOllama
+from app.database import SessionLocal
+from app.inference import inference_executor
+from app.models.chat import Conversation
+from app.shared import agent_state
+
+DEFAULT_TITLE = "New Conversation"
+TITLE_MAX_WORDS = int(os.getenv("TITLE_MAX_WORDS", "5"))
+TITLE_USE_LLM = os.getenv("TITLE_USE_LLM", "false").lower() in ("1", "true", "yes")
+TITLE_LLM_MAX_TOKENS = int(os.getenv("TITLE_LLM_MAX_TOKENS", "16"))
+
+# Words that carry no topic in a question
+TITLE_STOP_WORDS = STOP_WORDS | frozenset("""
+am could did explain give has help know like many much need please should tell
+than that these those us want would yes no ok okay
+""".split())
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9][\w'&+./-]*")
+
+def first_sentence(message: str) -> str:
+    return re.split(r"(?<=[.?!])\s+|\n", message.strip(), maxsplit=1)[0]
+
+def clean_title(title: str) -> str:
+    """Drop quotes and trailing punctuation, cap the length for the title column."""
+    title = title.replace('"', '').replace("'", "").strip().rstrip(".?!:;,")
+    words = title.split()[:TITLE_MAX_WORDS]
+    return " ".join(words)[:100]
+
+def extractive_title(message: str) -> str | None:
+    """Keywords of the first sentence, e.g. "Sick days employees"; None if there are too few."""
+    words = [word.rstrip(".") for word in WORD_PATTERN.findall(first_sentence(message))]
+    keywords = [word for word in words if word.lower() not in TITLE_STOP_WORDS]
+    if len(keywords) < 2:
+        return None
+    title = " ".join(keywords[:TITLE_MAX_WORDS])
+    # Keep the casing of terms like "eMMC" or "HDMI"
+    if keywords[0].islower():
+        title = title[0].upper() + title[1:]
+    return clean_title(title)
+
+def truncated_title(message: str) -> str:
+    """The first few words of the first sentence."""
+    return clean_title(first_sentence(message)) or DEFAULT_TITLE
+
+_title_llm = None
+
+def llm_title(message: str) -> str:
+    """Ask the chat model for a title, capped at TITLE_LLM_MAX_TOKENS tokens."""
+    global _title_llm
+    if _title_llm is None:
+        _title_llm = PooledChatOllama(model=agent_state.llm.model, temperature=0, num_predict=TITLE_LLM_MAX_TOKENS)
+    prompt = f"""Generate a short, concise title (max {TITLE_MAX_WORDS} words) for this conversation based on the first message.
+    Message: {message}
+    Title:"""
+    return clean_title(_title_llm.invoke(prompt).content)
+
+async def save_title(conversation_id: int, title: str):
+    """Store the title unless the conversation already has a real one."""
+    async with SessionLocal() as db:
+        conversation = await db.get(Conversation, conversation_id)
+        if conversation and conversation.title in (None, "", DEFAULT_TITLE):
+            conversation.title = title
+            with span("db_write"):
+                await db.commit()
+
+async def generate_conversation_title(conversation_id: int, message: str):
+    """Background task run after the first answer of a conversation is sent."""
+    title = extractive_title(message)
+    if title is None and TITLE_USE_LLM and agent_state.ready:
+        try:
+            title = await inference_executor.run(llm_title, message)
+        except Exception:
+            # Busy or failed: fall back to the first words of the question
+            pass
+    await save_title(conversation_id, title or truncated_title(message))
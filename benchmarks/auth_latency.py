@@ -0,0 +1,101 @@
+"""
+Measure login latency while chat streams are running.
+
+Registers throwaway users on a running server, keeps --chat-clients chat
+streams going, and fires --logins logins at --concurrency at a time. Prints
+login latency percentiles. Run it once with --chat-clients 0 for a baseline.
+Needs httpx (pip install httpx) and the server running, e.g. with uvicorn.
+
+    python benchmarks/auth_latency.py --url http://localhost:8000 --chat-clients 4 --logins 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+PASSWORD = "benchmark-password"
+
+async def register(client: httpx.AsyncClient, username: str):
+    await client.post("/register", data={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": PASSWORD,
+        "confirm_password": PASSWORD
+    })
+
+async def login(client: httpx.AsyncClient, username: str) -> float:
+    started_at = time.perf_counter()
+    response = await client.post("/login", data={"username": username, "password": PASSWORD})
+    elapsed = time.perf_counter() - started_at
+    if response.status_code != 303:
+        raise RuntimeError(f"login failed with {response.status_code}")
+    return elapsed
+
+async def chat_loop(url: str, username: str, question: str, stop: asyncio.Event, completed: list):
+    """Keep one chat stream going until stop is set."""
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        await login(client, username)
+        while not stop.is_set():
+            async with client.stream("POST", "/api/chat/stream", data={"message": question}) as response:
+                async for _ in response.aiter_bytes():
+                    if stop.is_set():
+                        break
+            completed.append(1)
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+async def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    login_users = [f"bench_{run_id}_login_{i}" for i in range(args.concurrency)]
+    chat_users = [f"bench_{run_id}_chat_{i}" for i in range(args.chat_clients)]
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        for username in login_users + chat_users:
+            await register(client, username)
+
+    stop = asyncio.Event()
+    completed = []
+    chats = [asyncio.create_task(chat_loop(args.url, username, args.question, stop, completed)) for username in chat_users]
+    # Let the streams get going before measuring
+    await asyncio.sleep(args.warmup)
+
+    latencies = []
+    remaining = iter(range(args.logins))
+
+    async def login_worker(username: str):
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+            for _ in remaining:
+                latencies.append(await login(client, username))
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(login_worker(username) for username in login_users))
+    elapsed = time.perf_counter() - started_at
+
+    stop.set()
+    for task in chats:
+        task.cancel()
+    await asyncio.gather(*chats, return_exceptions=True)
+
+    print(f"{len(latencies)} logins, {args.concurrency} at a time, {args.chat_clients} chat streams "
+          f"({len(completed)} finished) in {elapsed:.1f}s")
+    print(f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'mean':>8}  (ms)")
+    print(f"{percentile(latencies, 50) * 1000:>8.0f} {percentile(latencies, 95) * 1000:>8.0f} "
+          f"{percentile(latencies, 99) * 1000:>8.0f} {max(latencies) * 1000:>8.0f} "
+          f"{statistics.mean(latencies) * 1000:>8.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login latency under chat load")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=200, help="Total logins to measure")
+    parser.add_argument("--concurrency", type=int, default=8, help="Logins in flight at once")
+    parser.add_argument("--chat-clients", type=int, default=4, help="Concurrent chat streams")
+    parser.add_argument("--question", default="How many sick days do employees get?")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of chat load before measuring")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
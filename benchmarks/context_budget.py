@@ -0,0 +1,85 @@
+"""
+Measure how much reranking and context assembly shrink document prompts.
+
+Runs a fixed set of questions against the persisted Chroma collection and
+compares the tokens of all retrieved sections with the tokens of the
+reranked, assembled context. Each question names the section that answers
+it, so the report also shows whether that section survived. Ollama must be
+running and the embeddings must have been built (e.g. by starting the app).
+
+    python benchmarks/context_budget.py --max-tokens 1024 --max-chunks 4
+"""
+import argparse
+import os
+import sys
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.vectorstores import Chroma
+from agent.utils.context import ContextAssembler, count_tokens
+from agent.utils.embedding_cache import get_embeddings
+from agent.utils.ollama_client import EMBEDDING_MODEL
+from agent.utils.rerank import Reranker
+from agent.utils.retrieval import DocumentRetriever
+
+DB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent", "db")
+
+# (question, header of the section that answers it)
+EVAL_SET = [
+    ("How many sick days can I take?", "Sick Days"),
+    ("How far in advance do I need to request time off?", "Taking Leave"),
+    ("Which expenses are reimbursed?", "What's Covered"),
+    ("How do I file a reimbursement request?", "How to File a Reimbursement Request"),
+    ("When are performance assessments done?", "Performance Assessments"),
+    ("What is the drug and alcohol policy?", "Drug & Alcohol Policy"),
+    ("How long does maternity leave last?",
+     "4.1 How long does maternity leave last? Is a woman entitled to return to the same job after maternity leave?"),
+    ("Do fathers have the right to paternity leave?", "4.3 Do fathers have the right to take paternity leave?"),
+    ("Are restrictive covenants enforceable?", "7.2 When are restrictive covenants enforceable and for what period?"),
+    ("What is the eMMC storage of the rock960?", "Storage"),
+    ("Which processor does the rock960 board use?", "Processor"),
+    ("How do I start the board for the first time?", "Starting the board for the first time"),
+    ("What does the maskrom button do?", "Maskrom Button"),
+    ("What WiFi standards are supported?", "WiFi"),
+    ("How is the board powered?", "DC Power"),
+]
+
+def has_header(docs, header):
+    return any(doc.metadata.get("header", "").lstrip("# ").strip() == header for doc in docs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reranking and context assembly on a fixed eval set")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Ollama embedding model")
+    parser.add_argument("--k", type=int, default=10, help="Sections retrieved per question")
+    parser.add_argument("--top-n", type=int, default=6, help="Sections kept by the reranker")
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    parser.add_argument("--max-chunks", type=int, default=4)
+    parser.add_argument("--mmr-lambda", type=float, default=0.7)
+    args = parser.parse_args()
+
+    vectorstore = Chroma(persist_directory=DB_DIR, embedding_function=get_embeddings(args.model))
+    retriever = DocumentRetriever(vectorstore, k=args.k)
+    reranker = Reranker(top_n=args.top_n)
+    assembler = ContextAssembler(max_tokens=args.max_tokens, max_chunks=args.max_chunks, mmr_lambda=args.mmr_lambda)
+
+    total_before = total_after = retrieved_hits = kept_hits = 0
+    print(f"{'before':>7} {'after':>6} {'ratio':>6}  {'found':>5} {'kept':>5}  question")
+    for question, header in EVAL_SET:
+        retrieval = retriever.retrieve(question)
+        context = assembler.assemble(reranker.rerank(question, retrieval, retriever.lexical_index))
+        before = sum(count_tokens(doc.page_content) for doc in retrieval.documents)
+        found = has_header(retrieval.documents, header)
+        kept = has_header(context.documents, header)
+        total_before += before
+        total_after += context.tokens
+        retrieved_hits += found
+        kept_hits += kept
+        ratio = before / context.tokens if context.tokens else 0.0
+        print(f"{before:>7} {context.tokens:>6} {ratio:>5.1f}x  {str(found):>5} {str(kept):>5}  {question}")
+
+    print(f"\nContext tokens: {total_before} -> {total_after} ({total_before / max(total_after, 1):.1f}x smaller)")
+    print(f"Answering section retrieved: {retrieved_hits}/{len(EVAL_SET)}, kept in the prompt: {kept_hits}/{len(EVAL_SET)}")
+
+if __name__ == "__main__":
+    main()
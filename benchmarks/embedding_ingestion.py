@@ -0,0 +1,55 @@
+"""
+Benchmark the embedding ingestion pipeline at different concurrency levels.
+
+Embeds the markdown docs into a throwaway in-memory Chroma collection and
+reports chunks/second for each concurrency level. Ollama must be running.
+
+    python benchmarks/embedding_ingestion.py --concurrency 1 2 4 8 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.vectorstores import Chroma
+from agent.utils.compute_embeddings import load_markdown_documents
+from agent.utils.hash_utils import compute_chunk_id
+from agent.utils.ingestion import embed_and_store
+from agent.utils.embedding_cache import create_ollama_embeddings
+from agent.utils.ollama_client import EMBEDDING_MODEL
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent", "docs")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding ingestion throughput")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Ollama embedding model")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=1, help="Repeat the corpus to make it larger")
+    args = parser.parse_args()
+
+    base_docs = load_markdown_documents(DOCS_DIR)
+    docs = base_docs * args.repeat
+    ids = [f"{compute_chunk_id(doc)}:{i}" for i, doc in enumerate(docs)]
+    embedding = create_ollama_embeddings(args.model)
+
+    print(f"{len(docs)} chunks, batch size {args.batch_size}, model {args.model}")
+    results = []
+    for concurrency in args.concurrency:
+        vectorstore = Chroma(collection_name=f"bench_{concurrency}_{int(time.time())}", embedding_function=embedding)
+        started_at = time.perf_counter()
+        embed_and_store(docs, ids, vectorstore, embedding,
+                        batch_size=args.batch_size, concurrency=concurrency, progress=None)
+        elapsed = time.perf_counter() - started_at
+        results.append((concurrency, elapsed, len(docs) / elapsed))
+        vectorstore.delete_collection()
+
+    print(f"\n{'concurrency':>12} {'seconds':>10} {'chunks/s':>10}")
+    for concurrency, elapsed, rate in results:
+        print(f"{concurrency:>12} {elapsed:>10.2f} {rate:>10.1f}")
+
+if __name__ == "__main__":
+    main()
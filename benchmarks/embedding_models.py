@@ -0,0 +1,84 @@
+"""
+Compare embedding models on query latency, vector size and retrieval quality.
+
+Embeds the markdown docs and the context_budget eval questions with each
+model, without the embedding cache, and reports the median and p95 time to
+embed one query, the vector dimension, the bytes per vector in each cache
+dtype, and how often the answering section ranks in the top k. It does so
+for float32 vectors and for float16 and int8 quantized vectors. Ollama must
+be running with the models pulled.
+
+    python benchmarks/embedding_models.py --models llama2 nomic-embed-text all-minilm
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.utils.compute_embeddings import load_markdown_documents
+from agent.utils.embedding_cache import DTYPES, create_ollama_embeddings
+from context_budget import EVAL_SET, has_header
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent", "docs")
+
+def quantize(vectors: np.ndarray, dtype: str) -> np.ndarray:
+    """Round-trip vectors through the embedding cache's storage type."""
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1, keepdims=True) / 127
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales).astype(np.int8).astype(np.float32) * scales
+    return vectors.astype(dtype).astype(np.float32)
+
+def recall(doc_vectors: np.ndarray, query_vectors: np.ndarray, docs, k: int) -> int:
+    doc_units = doc_vectors / np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+    hits = 0
+    for (question, header), query in zip(EVAL_SET, query_vectors):
+        top = np.argsort(-(doc_units @ (query / np.linalg.norm(query))))[:k]
+        hits += has_header([docs[i] for i in top], header)
+    return hits
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding models")
+    parser.add_argument("--models", nargs="+", default=["llama2", "nomic-embed-text"])
+    parser.add_argument("--k", type=int, default=10, help="Sections retrieved per question")
+    args = parser.parse_args()
+
+    docs = load_markdown_documents(DOCS_DIR)
+    questions = [question for question, _ in EVAL_SET]
+    print(f"{len(docs)} sections, {len(questions)} questions, recall@{args.k}\n")
+    print(f"{'model':<24} {'dim':>5} {'p50 ms':>7} {'p95 ms':>7} {'docs/s':>7}  "
+          + "  ".join(f"{dtype:>14}" for dtype in DTYPES))
+    for model in args.models:
+        embeddings = create_ollama_embeddings(model)
+        embeddings.embed_query("warm up")  # loads the model
+
+        started_at = time.perf_counter()
+        doc_vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+        docs_per_second = len(docs) / (time.perf_counter() - started_at)
+
+        timings = []
+        query_vectors = []
+        for question in questions:
+            started_at = time.perf_counter()
+            query_vectors.append(embeddings.embed_query(question))
+            timings.append((time.perf_counter() - started_at) * 1000)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        timings.sort()
+
+        dim = doc_vectors.shape[1]
+        columns = []
+        for dtype in DTYPES:
+            size = dim * np.dtype(dtype).itemsize + (4 if dtype == "int8" else 0)
+            hits = recall(quantize(doc_vectors, dtype), quantize(query_vectors, dtype), docs, args.k)
+            columns.append(f"{size:>6}B {hits:>3}/{len(EVAL_SET):<3}")
+        print(f"{model:<24} {dim:>5} {statistics.median(timings):>7.1f} "
+              f"{timings[int(0.95 * (len(timings) - 1))]:>7.1f} {docs_per_second:>7.1f}  " + "  ".join(columns))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark markdown chunking on multi-MB corpora.
+
+Builds markdown files of growing size from the docs, plus nested headings,
+long code blocks, long tables and one section with no headings at all, and
+chunks each one with MarkdownChunker straight from disk. Reports the time
+per MB, which should stay flat as files grow, and the peak memory held while
+chunking, which should stay flat too because the file is streamed and
+chunks are consumed as they come. The old whole-file regex splitter is
+measured alongside for comparison. No Ollama needed.
+
+    python benchmarks/markdown_chunking.py --sizes 1 2 4 8 16
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.utils.chunking import MarkdownChunker
+from agent.utils.context import count_tokens
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent", "docs")
+
+def build_corpus(path: str, megabytes: float):
+    """Write a markdown file of about this many MB, repeating the docs with extra structure."""
+    docs = [open(os.path.join(DOCS_DIR, name), encoding="utf-8").read() for name in sorted(os.listdir(DOCS_DIR))
+            if name.endswith(".md")]
+    target = int(megabytes * 1024 * 1024)
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        copy = 0
+        while written < target:
+            copy += 1
+            parts = [f"# Copy {copy}\n\n"]
+            parts.extend(docs)
+            parts.append(f"\n## Appendix {copy}\n### Example code\n```python\n")
+            parts.extend(f"value_{i} = compute({i}, scale=2)  # step {i}\n" for i in range(300))
+            parts.append("```\n### Reference table\n| key | value |\n|-----|-------|\n")
+            parts.extend(f"| key {i} | value {i} for copy {copy} |\n" for i in range(300))
+            if copy % 4 == 0:
+                # One long stretch of text with no headings at all
+                parts.append("\n## Unstructured notes\n" + "Lorem ipsum dolor sit amet. " * 20000 + "\n")
+            text = "".join(parts)
+            f.write(text)
+            written += len(text.encode("utf-8"))
+    return written
+
+def regex_split(path: str):
+    """The previous splitter: the whole file in memory and one chunk per ## section."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    return re.findall(r"(##\s+.+?)(?=\n##\s+|\Z)", text, re.DOTALL)
+
+def measure(run):
+    """(seconds, count, max chunk tokens) of one run, and its peak traced memory in a second run."""
+    started_at = time.perf_counter()
+    count, max_tokens = run()
+    seconds = time.perf_counter() - started_at
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, count, max_tokens, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark markdown chunking time and memory")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 2, 4, 8], help="Corpus sizes in MB")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--overlap", type=int, default=64)
+    parser.add_argument("--skip-regex", action="store_true", help="Only measure the streaming chunker")
+    args = parser.parse_args()
+
+    chunker = MarkdownChunker(max_tokens=args.max_tokens, overlap_tokens=args.overlap)
+
+    def streaming(path):
+        count = max_tokens = 0
+        for doc in chunker.split_file(path):
+            count += 1
+            max_tokens = max(max_tokens, count_tokens(doc.page_content))
+        return count, max_tokens
+
+    def regex(path):
+        sections = regex_split(path)
+        return len(sections), max(count_tokens(section) for section in sections)
+
+    print(f"{'splitter':<10} {'MB':>6} {'seconds':>8} {'s/MB':>6} {'chunks':>7} {'max tok':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for megabytes in args.sizes:
+            path = os.path.join(directory, f"corpus_{megabytes}.md")
+            size = build_corpus(path, megabytes) / 1024 / 1024
+            splitters = [("streaming", streaming)] + ([] if args.skip_regex else [("regex", regex)])
+            for name, split in splitters:
+                seconds, count, max_tokens, peak = measure(lambda: split(path))
+                print(f"{name:<10} {size:>6.1f} {seconds:>8.2f} {seconds / size:>6.2f} {count:>7} {max_tokens:>8} "
+                      f"{peak / 1024 / 1024:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import uuid
+
+import httpx
+import pytest
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read when app.database and the Ollama pools are first used
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+os.environ["WEB_SEARCH_BACKEND"] = "stub"
+
+from agent.utils.fake_ollama import FakeOllama
+
+DOCUMENTS = {
+    "## Vacation\nEmployees get 25 vacation days per year, planned with their manager.": "hr_manual.md",
+    "## Sick days\nReport sick days to HR before 10am on the first day.": "hr_manual.md",
+    "## HDMI output\nThe rock960 board drives a 4K display through its HDMI port.": "product_manual.md",
+}
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def db(monkeypatch):
+    """Session factory of an in-memory SQLite database, used by the app's get_db and background tasks."""
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import StaticPool
+    from app import titles
+    from app.auth import auth
+    from app.database import Base, get_db
+    from app.main import app
+
+    # One shared connection, or every session would see its own empty database
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    async def get_test_db():
+        async with sessions() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = get_test_db
+    monkeypatch.setattr(titles, "SessionLocal", sessions)
+    # User ids start over with every database
+    monkeypatch.setattr(auth, "user_cache", auth.UserCache())
+    yield sessions
+    app.dependency_overrides.pop(get_db, None)
+    await engine.dispose()
+
+@pytest.fixture
+async def client():
+    """An HTTP client for the app; it keeps the session cookie between requests."""
+    from app.main import app
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+@pytest.fixture
+async def user(db):
+    """A registered user, alice, whose password is "secret"."""
+    from app.auth.auth import get_password_hash
+    from app.models.user import User
+    async with db() as session:
+        user = User(username="alice", email="alice@example.com", password=get_password_hash("secret"))
+        session.add(user)
+        await session.commit()
+        return user
+
+@pytest.fixture
+async def signed_in(user, client):
+    """The client, logged in as user."""
+    response = await client.post("/login", data={"username": "alice", "password": "secret"})
+    assert response.status_code == 303
+    return client
+
+@pytest.fixture(scope="session")
+def fake_ollama():
+    """A FakeOllama that both Ollama pools point at."""
+    from agent.utils import ollama_client
+    with FakeOllama(reply="Hello! How can I help you today?") as server:
+        os.environ["OLLAMA_BASE_URL"] = server.url
+        ollama_client._pools.clear()
+        yield server
+        ollama_client._pools.clear()
+
+@pytest.fixture
+def agent(fake_ollama, tmp_path, monkeypatch):
+    """Ready KB agent components over a few documents, installed in agent_state."""
+    from langchain.schema import Document
+    from langchain_community.vectorstores import Chroma
+    from agent.kb_agent import answer_cache, create_web_search_tool
+    from agent.utils import DocumentRetriever
+    from agent.utils.ollama_client import CHAT_MODEL, EMBEDDING_MODEL, PooledChatOllama, PooledOllamaEmbeddings
+    from agent.utils.web_search import StubBackend, create_web_search
+    from app.shared import agent_state
+
+    monkeypatch.setenv("WEB_SEARCH_STATE_PATH", str(tmp_path / "web_search.sqlite3"))
+    vectorstore = Chroma.from_documents(
+        [Document(page_content=text, metadata={"source": source}) for text, source in DOCUMENTS.items()],
+        PooledOllamaEmbeddings(model=EMBEDDING_MODEL),
+        collection_name=f"test-{uuid.uuid4().hex}"
+    )
+    web_search = create_web_search(StubBackend())
+    components = ([None, create_web_search_tool(web_search)], PooledChatOllama(model=CHAT_MODEL, temperature=0),
+                  DocumentRetriever(vectorstore, k=3, lexical_min_score=1.0))
+    answer_cache.clear()
+    monkeypatch.setattr(agent_state, "web_search", web_search)
+    monkeypatch.setattr(agent_state, "ready", True)
+    for name, value in zip(("tools", "llm", "retriever"), components):
+        monkeypatch.setattr(agent_state, name, value)
+    yield components
+    answer_cache.clear()
+    vectorstore.delete_collection()
@@ -0,0 +1,8 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+async def test_small_talk_is_answered_as_text(agent, client):
+    response = await client.post("/ask", json={"question": "hello"})
+    assert response.status_code == 200
+    assert response.json() == {"answer": "Hello! How can I help you today?", "sources": []}
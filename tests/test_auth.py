@@ -0,0 +1,28 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+async def test_login_starts_a_session(user, client):
+    response = await client.post("/login", data={"username": "alice", "password": "secret"})
+    assert response.status_code == 303
+    assert response.headers["location"] == "/welcome?username=alice"
+    assert (await client.get("/api/conversations")).status_code == 200
+
+async def test_login_with_a_wrong_password(user, client):
+    response = await client.post("/login", data={"username": "alice", "password": "wrong"})
+    assert response.status_code == 200
+    assert "Incorrect password" in response.text
+    assert "session" not in client.cookies
+
+async def test_unknown_user_cannot_log_in(db, client):
+    response = await client.post("/login", data={"username": "nobody", "password": "secret"})
+    assert "User does not exist" in response.text
+
+async def test_api_requires_a_session(db, client):
+    response = await client.get("/api/conversations")
+    assert response.status_code == 307
+    assert response.headers["location"].startswith("/login?error=")
+
+async def test_logout_ends_the_session(signed_in):
+    await signed_in.get("/logout")
+    assert (await signed_in.get("/api/conversations")).status_code == 307
@@ -0,0 +1,152 @@
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app.models.chat import Conversation, Message
+from app.models.user import User
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 1, 1)
+
+async def add_conversations(db, user_id, count, same_time=False):
+    """count conversations, the later ones more recently active; returns their ids."""
+    async with db() as session:
+        conversations = [
+            Conversation(user_id=user_id, title=f"Conversation {i}", created_at=START,
+                         updated_at=START if same_time else START + timedelta(minutes=i))
+            for i in range(count)
+        ]
+        session.add_all(conversations)
+        await session.flush()
+        for i, conversation in enumerate(conversations):
+            session.add_all(Message(conversation_id=conversation.id, role="user", content=f"Message {j} of {i}",
+                                    created_at=START + timedelta(minutes=j)) for j in range(i))
+        await session.commit()
+        return [conversation.id for conversation in conversations]
+
+async def add_messages(db, user_id, count, same_time=False):
+    """A conversation with count messages, one a minute; returns their ids in order."""
+    async with db() as session:
+        conversation = Conversation(user_id=user_id, created_at=START, updated_at=START)
+        session.add(conversation)
+        await session.flush()
+        messages = [
+            Message(conversation_id=conversation.id, role="user", content=f"Message {i}",
+                    created_at=START if same_time else START + timedelta(minutes=i))
+            for i in range(count)
+        ]
+        session.add_all(messages)
+        await session.commit()
+        return conversation.id, [message.id for message in messages]
+
+async def all_pages(client, limit):
+    pages = []
+    cursor = None
+    while True:
+        params = {"limit": limit} | ({"cursor": cursor} if cursor else {})
+        response = await client.get("/api/conversations", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        pages.append(page["conversations"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+async def test_chat_answers_and_stores_the_turn(agent, db, user, signed_in):
+    response = await signed_in.post("/api/chat", data={"message": "rock960 HDMI"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["message"] == "Hello! How can I help you today?"
+    assert body["sources"][0]["source"] == "product_manual.md"
+
+    async with db() as session:
+        conversation = await session.get(Conversation, body["conversation_id"])
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+    assert conversation.user_id == user.id
+    # Titled by the background task once the answer was sent
+    assert conversation.title == "Rock960 HDMI"
+    assert [(message.role, message.content) for message in messages] == [
+        ("user", "rock960 HDMI"), ("assistant", "Hello! How can I help you today?")
+    ]
+
+    response = await signed_in.post("/api/chat", data={"message": "hello", "conversation_id": body["conversation_id"]})
+    assert response.json()["conversation_id"] == body["conversation_id"]
+
+async def test_chat_in_someone_elses_conversation(agent, db, signed_in):
+    async with db() as session:
+        session.add(User(id=2, username="bob", email="bob@example.com", password="x"))
+        await session.commit()
+    [conversation_id] = await add_conversations(db, 2, 1)
+    response = await signed_in.post("/api/chat", data={"message": "hello", "conversation_id": conversation_id})
+    assert response.status_code == 404
+
+async def test_chat_while_the_agent_starts(db, signed_in):
+    response = await signed_in.post("/api/chat", data={"message": "hello"})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+async def test_conversation_pages(db, user, signed_in):
+    ids = await add_conversations(db, user.id, 5)
+    pages = await all_pages(signed_in, limit=2)
+    assert [[c["id"] for c in page] for page in pages] == [ids[4:2:-1], ids[2:0:-1], ids[:1]]
+    first = pages[0][0]
+    assert (first["message_count"], first["last_message_preview"]) == (4, "Message 3 of 4")
+    assert (pages[-1][0]["message_count"], pages[-1][0]["last_message_preview"]) == (0, None)
+
+async def test_conversation_pages_break_ties_on_id(db, user, signed_in):
+    ids = await add_conversations(db, user.id, 5, same_time=True)
+    pages = await all_pages(signed_in, limit=2)
+    assert [c["id"] for page in pages for c in page] == ids[::-1]
+
+async def test_full_last_page_has_no_next_cursor(db, user, signed_in):
+    await add_conversations(db, user.id, 4)
+    pages = await all_pages(signed_in, limit=2)
+    assert [len(page) for page in pages] == [2, 2]
+
+async def test_conversations_of_other_users_are_not_listed(db, user, signed_in):
+    async with db() as session:
+        session.add(User(id=2, username="bob", email="bob@example.com", password="x"))
+        await session.commit()
+    await add_conversations(db, 2, 3)
+    assert await all_pages(signed_in, limit=20) == [[]]
+
+async def test_invalid_conversation_cursors(db, user, signed_in):
+    await add_conversations(db, user.id, 1)
+    for cursor in ["not-base64!", base64.urlsafe_b64encode(b"yesterday|1").decode(),
+                   base64.urlsafe_b64encode(b"2026-01-01T00:00:00").decode()]:
+        response = await signed_in.get("/api/conversations", params={"cursor": cursor})
+        assert response.status_code == 400, cursor
+    assert (await signed_in.get("/api/conversations", params={"limit": 0})).status_code == 422
+
+async def test_message_pages(db, user, signed_in):
+    conversation_id, ids = await add_messages(db, user.id, 7)
+    url = f"/api/conversations/{conversation_id}/messages"
+
+    latest = (await signed_in.get(url, params={"limit": 3})).json()
+    assert [m["id"] for m in latest] == ids[4:]
+    older = (await signed_in.get(url, params={"limit": 3, "before": latest[0]["id"]})).json()
+    assert [m["id"] for m in older] == ids[1:4]
+    oldest = (await signed_in.get(url, params={"limit": 3, "before": older[0]["id"]})).json()
+    assert [m["id"] for m in oldest] == ids[:1]
+    newer = (await signed_in.get(url, params={"limit": 3, "after": ids[1]})).json()
+    assert [m["id"] for m in newer] == ids[2:5]
+
+async def test_message_pages_break_ties_on_id(db, user, signed_in):
+    conversation_id, ids = await add_messages(db, user.id, 5, same_time=True)
+    url = f"/api/conversations/{conversation_id}/messages"
+    assert [m["id"] for m in (await signed_in.get(url, params={"limit": 2, "before": ids[3]})).json()] == ids[1:3]
+    assert [m["id"] for m in (await signed_in.get(url, params={"limit": 2, "after": ids[1]})).json()] == ids[2:4]
+
+async def test_message_cursor_edge_cases(db, user, signed_in):
+    conversation_id, ids = await add_messages(db, user.id, 3)
+    url = f"/api/conversations/{conversation_id}/messages"
+    response = await signed_in.get(url, params={"before": ids[2], "after": ids[0]})
+    assert response.status_code == 400
+    # A cursor from another conversation matches nothing
+    other_id, other_ids = await add_messages(db, user.id, 1)
+    assert (await signed_in.get(url, params={"before": other_ids[0]})).json() == []
+    assert (await signed_in.get(f"/api/conversations/{other_id}/messages")).json()[0]["id"] == other_ids[0]
+    assert (await signed_in.get("/api/conversations/999/messages")).status_code == 404
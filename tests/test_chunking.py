@@ -0,0 +1,64 @@
+from agent.utils.chunking import MarkdownChunker
+from agent.utils.context import count_tokens
+
+def split(text, **kwargs):
+    return list(MarkdownChunker(**kwargs).split(text.splitlines(keepends=True), "test.md"))
+
+def code_section(lines):
+    return "## Setup\n```bash\n" + "".join(f"sudo apt-get install package-{i}\n" for i in range(lines)) + "\n```\n"
+
+def test_closing_fence_on_the_budget_boundary():
+    # With the default size, the closing fence of this block is the line that fills the chunk
+    docs = split(code_section(50))
+    assert len(docs) == 1
+    assert docs[0].page_content.endswith("package-49\n\n```")
+    assert count_tokens(docs[0].page_content) <= 512
+
+def test_split_code_blocks_stay_fenced_wherever_the_boundary_falls():
+    # Some of these sizes put the closing fence exactly on a chunk boundary
+    for max_tokens in range(40, 130, 2):
+        for lines in range(1, 40):
+            docs = split(code_section(lines), max_tokens=max_tokens, overlap_tokens=8)
+            for doc in docs:
+                assert doc.page_content.count("```") == 2, (max_tokens, lines, doc.page_content)
+                assert count_tokens(doc.page_content) <= max_tokens
+            assert f"package-{lines - 1}" in docs[-1].page_content
+
+def test_front_matter_is_skipped():
+    docs = split("---\ntitle: Manual\n---\nIntro text.\n## Usage\nRun it.\n")
+    assert [doc.page_content for doc in docs] == ["Intro text.", "## Usage\nRun it."]
+
+def test_unclosed_front_matter_is_kept_as_content():
+    docs = split("---\nIntro text.\n## Usage\nRun it.\n")
+    assert [doc.page_content for doc in docs] == ["---\nIntro text.", "## Usage\nRun it."]
+
+def test_heading_path_and_preamble():
+    docs = split("Preamble.\n# Guide\nTop.\n## Install\nSteps.\n### Linux\nApt.\n## Use\nRun.\n")
+    assert [(doc.metadata["header"], doc.metadata["heading_path"]) for doc in docs] == [
+        ("", ""),
+        ("Guide", "Guide"),
+        ("Install", "Guide > Install"),
+        ("Linux", "Guide > Install > Linux"),
+        ("Use", "Guide > Use"),
+    ]
+
+def test_long_heading_is_cut_to_keep_chunks_within_max_tokens():
+    title = " ".join(f"word{i}" for i in range(40))
+    docs = split(f"## {title}\n" + "Body text goes here. " * 30 + "\n", max_tokens=32, overlap_tokens=4)
+    assert len(docs) > 1
+    for doc in docs:
+        assert count_tokens(doc.page_content) <= 32
+        assert doc.page_content.startswith("## word0 word1")
+        assert doc.metadata["header"] == title
+
+def test_wide_table_header_and_long_fence_line_are_not_repeated():
+    header = "| " + " | ".join(f"column {i}" for i in range(12)) + " |\n|" + "---|" * 12 + "\n"
+    table = header + "| a | b |\n" * 30
+    fence = "```bash title=" + "_".join(f"part{i}" for i in range(20)) + "\n" + "echo step\n" * 30 + "```\n"
+    for text in ("## Table\n" + table, "## Code\n" + fence):
+        docs = split(text, max_tokens=32, overlap_tokens=4)
+        assert len(docs) > 1
+        for doc in docs:
+            assert count_tokens(doc.page_content) <= 32, doc.page_content
+    docs = split("## Code\n" + fence, max_tokens=32, overlap_tokens=4)
+    assert all(doc.page_content.count("```") == 2 for doc in docs[1:])
@@ -0,0 +1,129 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from app.coalescing import RequestCoalescer, StreamCancelled
+
+pytestmark = pytest.mark.anyio
+
+class Producer:
+    """A produce() for RequestCoalescer.stream that publishes when told to."""
+
+    def __init__(self, cleanup_delay=0.0):
+        self.cleanup_delay = cleanup_delay
+        self.started = 0
+        self.cancelled = 0
+        self.cleaned_up = False
+        self.steps = asyncio.Queue()
+
+    async def __call__(self, shared):
+        self.started += 1
+        try:
+            while True:
+                event = await self.steps.get()
+                if event is None:
+                    return
+                if isinstance(event, Exception):
+                    raise event
+                shared.publish(event)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            # Like closing the Ollama request, this takes a moment
+            await asyncio.sleep(self.cleanup_delay)
+            self.cleaned_up = True
+            raise
+
+async def read(stream, count=None):
+    """Up to count events of an async iterator, then close it."""
+    events = []
+    async with aclosing(stream) as events_in:
+        async for event in events_in:
+            events.append(event)
+            if len(events) == count:
+                break
+    return events
+
+async def test_subscriber_leaves_while_the_other_finishes():
+    coalescer = RequestCoalescer()
+    produce = Producer()
+    leaving = asyncio.create_task(read(coalescer.stream("Question", produce), count=1))
+    staying = asyncio.create_task(read(coalescer.stream("  question ", produce)))
+    await asyncio.sleep(0.01)  # both subscribed
+    await produce.steps.put(("token", "a"))
+    assert await leaving == [("token", "a")]
+    await produce.steps.put(("token", "b"))
+    await produce.steps.put(None)
+    assert await staying == [("token", "a"), ("token", "b")]
+    assert (produce.started, produce.cancelled) == (1, 0)
+    assert coalescer.stats()["streams_coalesced"] == 1
+    assert coalescer.stats()["streams_in_flight"] == 0
+
+async def test_last_subscriber_leaving_cancels_the_stream():
+    coalescer = RequestCoalescer()
+    produce = Producer()
+    reader = asyncio.create_task(read(coalescer.stream("question", produce), count=1))
+    await produce.steps.put(("token", "a"))
+    assert await reader == [("token", "a")]
+    assert coalescer.stats()["streams_in_flight"] == 0
+    await asyncio.sleep(0)
+    assert produce.cancelled == 1
+
+async def test_request_during_cancellation_gets_a_fresh_stream():
+    coalescer = RequestCoalescer()
+    dying = Producer(cleanup_delay=0.2)
+    await dying.steps.put(("token", "old"))
+    assert await read(coalescer.stream("question", dying), count=1) == [("token", "old")]
+    await asyncio.sleep(0)
+    assert dying.cancelled == 1 and not dying.cleaned_up
+
+    async def compute():
+        return {"answer": "computed", "sources": []}
+
+    assert await coalescer.answer("question", compute) == {"answer": "computed", "sources": []}
+    fresh = Producer()
+    reader = asyncio.create_task(read(coalescer.stream("question", fresh)))
+    await fresh.steps.put(("token", "new"))
+    await fresh.steps.put(None)
+    assert await reader == [("token", "new")]
+    assert fresh.started == 1
+    assert not dying.cleaned_up
+    assert coalescer.stats()["streams_started"] == 2
+
+async def test_leader_error_reaches_every_subscriber():
+    coalescer = RequestCoalescer()
+    produce = Producer()
+    readers = [asyncio.create_task(read(coalescer.stream("question", produce))) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    collector = asyncio.create_task(coalescer.answer("question", None))
+    await asyncio.sleep(0.01)
+    await produce.steps.put(("sources", []))
+    await produce.steps.put(RuntimeError("Ollama went away"))
+    for task in readers + [collector]:
+        with pytest.raises(RuntimeError, match="Ollama went away"):
+            await task
+    assert produce.started == 1
+
+async def test_stopped_stream_ends_subscribers_with_an_ordinary_error():
+    coalescer = RequestCoalescer()
+    produce = Producer()
+    reader = asyncio.create_task(read(coalescer.stream("question", produce)))
+    await produce.steps.put(("token", "a"))
+    await asyncio.sleep(0.01)
+    # E.g. the server shutting down
+    coalescer._streams[coalescer.key("question")].task.cancel()
+    with pytest.raises(StreamCancelled):
+        await reader
+
+async def test_answer_followers_share_the_leaders_result():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"answer": "shared", "sources": []}
+
+    results = await asyncio.gather(*(coalescer.answer("Question", compute) for _ in range(3)))
+    assert results == [{"answer": "shared", "sources": []}] * 3
+    assert len(calls) == 1
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from agent.utils.embedding_cache import EmbeddingCache
+
+def vectors(count, dim=8, offset=0):
+    return {f"key-{i}": [float(i + 1)] * dim for i in range(offset, offset + count)}
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_reads_rows_another_process_added_after_growing_the_file(tmp_path, dtype):
+    # Two caches on one directory, like two worker processes
+    writer = EmbeddingCache(str(tmp_path), initial_capacity=2, dtype=dtype)
+    writer.put_many(vectors(2))
+    reader = EmbeddingCache(str(tmp_path), initial_capacity=2, dtype=dtype)
+    assert len(reader.get_many(["key-0"])) == 1
+
+    writer.put_many(vectors(30, offset=2))
+    assert writer.capacity > 2
+    found = reader.get_many(list(vectors(32)))
+    assert len(found) == 32
+    assert np.allclose(found["key-31"], [32.0] * 8, rtol=0.01)
+
+    # The reader grows the file from the writer's size, not its own stale one
+    reader.put_many(vectors(40, offset=32))
+    assert reader.capacity >= 72
+    assert np.allclose(writer.get_many(["key-71"])["key-71"], [72.0] * 8, rtol=0.01)
+
+def test_sees_the_first_vectors_another_process_stored(tmp_path):
+    reader = EmbeddingCache(str(tmp_path))
+    assert reader.get_many(["key-0"]) == {}
+    EmbeddingCache(str(tmp_path)).put_many(vectors(1))
+    assert reader.get_many(["key-0"]) == {"key-0": [1.0] * 8}
+
+def test_counters_are_exact_under_concurrent_lookups(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many(vectors(10))
+    keys = list(vectors(20))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: cache.get_many(keys), range(200)))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2000, 2000)
+    assert stats["entries"] == 10
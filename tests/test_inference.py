@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app import main
+from app.inference import InferenceExecutor, InferenceQueueFull
+from app.routers import chat
+
+pytestmark = pytest.mark.anyio
+
+async def fill(executor):
+    """Hold every slot and queue place of executor until the returned event is set."""
+    release = asyncio.Event()
+
+    async def hold():
+        async with executor.slot():
+            await release.wait()
+
+    tasks = [asyncio.create_task(hold()) for _ in range(executor.max_concurrency + executor.max_queue)]
+    await asyncio.sleep(0)
+    return release, tasks
+
+@pytest.fixture
+async def full_executor(monkeypatch):
+    executor = InferenceExecutor(max_concurrency=1, max_queue=1)
+    # Finished jobs took 20 s on average
+    executor.completed, executor.total_run_seconds = 2, 40.0
+    monkeypatch.setattr(main, "inference_executor", executor)
+    monkeypatch.setattr(chat, "inference_executor", executor)
+    release, tasks = await fill(executor)
+    yield executor
+    release.set()
+    await asyncio.gather(*tasks)
+
+async def test_full_queue_raises_with_a_retry_estimate(full_executor):
+    assert (full_executor.running, full_executor.queued) == (1, 1)
+    with pytest.raises(InferenceQueueFull) as raised:
+        await full_executor.run(sum, [1, 2])
+    # One job running and one queued ahead, on one slot
+    assert raised.value.retry_after == 40
+    assert full_executor.rejected == 1
+
+async def test_queued_job_runs_once_a_slot_frees_up():
+    executor = InferenceExecutor(max_concurrency=1, max_queue=1)
+    release, tasks = await fill(executor)
+    release.set()
+    await asyncio.gather(*tasks)
+    assert await executor.run(sum, [1, 2]) == 3
+    assert executor.stats()["completed"] == 3
+
+async def test_ask_answers_503_with_retry_after(agent, client, full_executor):
+    response = await client.post("/ask", json={"question": "hello"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "40"
+
+async def test_chat_answers_503_before_storing_the_message(agent, db, signed_in, full_executor):
+    response = await signed_in.post("/api/chat", data={"message": "hello"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "40"
+    assert (await signed_in.get("/api/conversations")).json()["conversations"] == []
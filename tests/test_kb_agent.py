@@ -0,0 +1,46 @@
+from agent.kb_agent import needs_query_embedding, run_custom_agent, run_custom_agent_batch
+
+def count_calls(monkeypatch, obj, name):
+    calls = []
+    method = getattr(obj, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return method(*args, **kwargs)
+
+    monkeypatch.setattr(obj, name, counted)
+    return calls
+
+def test_lexically_decisive_question_is_not_embedded(agent):
+    _, _, retriever = agent
+    needed, hits = needs_query_embedding("rock960 HDMI", retriever)
+    assert not needed
+    assert hits[0][0] == retriever.lexical_index.ids[2]
+
+def test_repeated_lexical_question_is_answered_from_the_cache(agent, fake_ollama, monkeypatch):
+    _, _, retriever = agent
+    searches = count_calls(monkeypatch, retriever, "lexical_search")
+    chats = fake_ollama.requests.get("/api/chat", 0)
+    embeddings = fake_ollama.requests.get("/api/embeddings", 0)
+
+    first = run_custom_agent("rock960 HDMI", *agent)
+    assert first["route"] == "Document Retriever"
+    assert len(searches) == 1  # shared by needs_query_embedding and routing
+    assert run_custom_agent("  Rock960 hdmi ", *agent) == first
+    assert fake_ollama.requests.get("/api/chat", 0) == chats + 1
+    assert fake_ollama.requests.get("/api/embeddings", 0) == embeddings
+
+def test_embedded_question_searches_bm25_once(agent, monkeypatch):
+    _, _, retriever = agent
+    searches = count_calls(monkeypatch, retriever, "lexical_search")
+    response = run_custom_agent("How many vacation days do employees get?", *agent)
+    assert response["route"] == "Document Retriever"
+    assert len(searches) == 1
+
+def test_batch_reuses_exact_cache_entries(agent, fake_ollama):
+    run_custom_agent("hello", *agent)
+    chats = fake_ollama.requests.get("/api/chat", 0)
+    responses = run_custom_agent_batch(["Hello", "rock960 HDMI", "rock960 hdmi"], *agent)
+    assert responses[0]["answer"] == "Hello! How can I help you today?"
+    assert responses[1] == responses[2]
+    assert fake_ollama.requests.get("/api/chat", 0) == chats + 1
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from agent.kb_agent import create_web_search_tool
+from agent.utils.web_search import StubBackend, TokenBucket, WebSearch, WebSearchRateLimited
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "web_search.sqlite3")
+
+def test_bucket_is_exhausted_after_its_burst(state_path):
+    bucket = TokenBucket(state_path, rate=0.01, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    wait = bucket.try_acquire()
+    assert 99 < wait <= 100  # a whole token at 0.01 tokens per second
+
+def test_bucket_refills_over_time(state_path):
+    bucket = TokenBucket(state_path, rate=20, capacity=1)
+    assert bucket.try_acquire() == 0
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 0.05
+    time.sleep(wait + 0.02)
+    assert bucket.try_acquire() == 0
+
+def test_bucket_is_shared_through_its_file(state_path):
+    # Like two worker processes on one host
+    first, second = TokenBucket(state_path, rate=0.01, capacity=2), TokenBucket(state_path, rate=0.01, capacity=2)
+    assert first.try_acquire() == 0
+    assert second.try_acquire() == 0
+    assert first.try_acquire() > 0
+    assert TokenBucket(state_path, rate=0.01, capacity=2, name="other").try_acquire() == 0
+
+def test_acquire_waits_for_a_refill_or_gives_up(state_path):
+    bucket = TokenBucket(state_path, rate=10, capacity=1)
+    bucket.acquire(max_wait=0)
+    started_at = time.monotonic()
+    bucket.acquire(max_wait=1)
+    assert time.monotonic() - started_at >= 0.05
+    with pytest.raises(WebSearchRateLimited) as raised:
+        bucket.acquire(max_wait=0.01)
+    assert raised.value.retry_after > 0.01
+
+def test_searches_are_cached_and_coalesced(state_path):
+    backend = StubBackend({"minimum wage": "It is 15 an hour."}, delay=0.1)
+    search = WebSearch(backend, TokenBucket(state_path, rate=0.01, capacity=1))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(search.search("Minimum wage?"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["It is 15 an hour."] * 3
+    assert search.search("minimum  WAGE") == "It is 15 an hour."
+    assert backend.calls == 1
+    assert search.stats()["coalesced"] + search.stats()["hits"] == 3
+
+def test_rate_limited_search_asks_to_try_again(state_path):
+    search = WebSearch(StubBackend(), TokenBucket(state_path, rate=0.01, capacity=1), max_wait=1)
+    tool = create_web_search_tool(search)
+    assert tool.func("first question") == "No web results available."
+    assert tool.func("second question").startswith("Web search is busy right now. Please try again in 100 seconds")
+    assert search.stats()["rate_limited"] == 1